@@ -1,209 +1,904 @@
-from flask import Flask, request
-from sqlalchemy import create_engine, and_
+from flask import Flask, Response, request
+from sqlalchemy import case, func, select, text
+from sqlalchemy.event import listens_for
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
+from cache import LRUCache
+from config import Config
+from database import make_engine
+from duplicates import DuplicateFilter
+from encoders import encode_match, encode_match_line, encode_matches, encode_matches_ndjson, encode_odds_delta, \
+    encode_odds_history
+from ingest_queue import IngestQueue
+from logging_config import OddsLogSummary, configure_logging
+from metrics import RequestMetrics
 from models import *
+from odds_index import OddsIndex
+from partitions import DEFAULT, Partitions, parse_partitions
+from pubsub import Broker
+from queries import encode_cursor, event_version_query, listing_version_statement, match_query, merge_matches, \
+    matches_query, matches_rows_query, odds_history_query
+from validation import message_error
+from werkzeug.http import http_date, quote_etag
+from writer import WriterClient, WriterUnavailable
 from datetime import datetime
+import atexit
+import gzip
 import json
 import logging
+import signal
+import sys
+import threading
 
 app = Flask(__name__)
-engine = create_engine('sqlite:///db.sqlite3', echo=True)
-Session = sessionmaker(bind=engine)
-session = Session()
-Base.metadata.create_all(engine)
-logging.basicConfig(filename='api.log', level=logging.DEBUG)
+app.config.from_object(Config)
+Session = sessionmaker()
+log = logging.getLogger('ingest')
+setup_lock = threading.Lock()
+ready = False
+# created by create_app, at the latest on the first request, so importing the module touches no database
+engine = engines = partitions = session = None
+odds_log = match_cache = odds_index = duplicate_filter = broker = request_metrics = writer_client = ingest_queue = None
+
+IN_CHUNK_SIZE = 500
+
+
+def connect():
+    global engine, engines, partitions, session
+    if partitions is not None:
+        return
+    sport_urls = parse_partitions(app.config['SPORT_PARTITIONS'])
+    engine = make_engine(app.config)
+    engines = {DEFAULT: engine}
+    for url in sport_urls.values():
+        if url not in engines:
+            engines[url] = make_engine(dict(app.config, DATABASE_URL=url))
+    partitions = Partitions(engines, sport_urls, Session)
+    session = partitions.session
+
+
+def init_db():
+    connect()
+    for partition_engine in engines.values():
+        Base.metadata.create_all(partition_engine)
+        add_missing_columns(partition_engine)
+        create_indexes(partition_engine)
+        backfill_event_markets(partition_engine)
+        create_data_versions(partition_engine)
+
+
+def create_app(config=None):
+    global ready, odds_log, match_cache, odds_index, duplicate_filter, broker, request_metrics, writer_client, \
+        ingest_queue
+    with setup_lock:
+        if ready:
+            # one app per process; settings given after the set-up, or after the first request, would be ignored
+            if config is not None:
+                raise RuntimeError('The app is already set up, create_app(config) must run before the first request')
+            return app
+        if isinstance(config, dict):
+            app.config.from_mapping(config)
+        elif config is not None:
+            app.config.from_object(config)
+        configure_logging(app.config)
+        connect()
+        if app.config['SCHEMA_CHECK'] and app.config['ROLE'] != 'reader':
+            # readers open the database read-only, the writer owns the schema
+            init_db()
+
+        odds_log = OddsLogSummary(logging.getLogger('ingest.odds'), app.config['ODDS_LOG_INTERVAL'],
+                                  app.config['ODDS_LOG_SAMPLE_RATE'])
+        match_cache = LRUCache(app.config['MATCH_CACHE_SIZE'], app.config['MATCH_CACHE_TTL'])
+        odds_index = OddsIndex()
+        if app.config['ODDS_INDEX'] and app.config['ROLE'] != 'reader':
+            odds_table = Odd.__table__
+            for partition_engine in engines.values():
+                odds_index.warm(partition_engine.execute(
+                    select([odds_table.c.MarketId, odds_table.c.SelectionId, odds_table.c.Odd])))
+        duplicate_filter = DuplicateFilter(app.config['DUPLICATE_FILTER_CAPACITY'],
+                                           app.config['DUPLICATE_FILTER_ERROR_RATE'],
+                                           app.config['DUPLICATE_RECENT_SIZE'])
+        if app.config['DUPLICATE_FILTER'] and app.config['ROLE'] != 'reader':
+            for partition_engine in engines.values():
+                warm_duplicate_filter(partition_engine)
+        broker = Broker(app.config['STREAM_BUFFER_SIZE'])
+        request_metrics = RequestMetrics(app.config['SLOW_REQUEST_MS'], logging.getLogger('slow_requests'))
+        if app.config['METRICS']:
+            for partition_engine in engines.values():
+                request_metrics.instrument(partition_engine)
+        writer_client = WriterClient(app.config['WRITER_ADDRESS'], app.config['WRITER_AUTHKEY'],
+                                     app.config['WRITER_TIMEOUT'])
+        ingest_queue = IngestQueue(apply_queued_messages, app.config['INGEST_QUEUE_SIZE'],
+                                   app.config['INGEST_BATCH_SIZE'], app.config['INGEST_LINGER_MS'] / 1000)
+        if app.config['INGEST_ASYNC'] and app.config['ROLE'] != 'reader':
+            ingest_queue.start()
+            atexit.register(ingest_queue.stop)
+        ready = True
+    return app
+
+
+def warm_duplicate_filter(partition_engine):
+    for kind, table in (('message', Message.__table__), ('event', Event.__table__)):
+        duplicate_filter.add(kind, (row[0] for row in partition_engine.execute(select([table.c.Id]))), recent=False)
+        # the latest rows are the ones providers may still resend
+        latest = select([table.c.Id]).order_by(text('rowid DESC')).limit(app.config['DUPLICATE_RECENT_SIZE'])
+        duplicate_filter.add(kind, reversed([row[0] for row in partition_engine.execute(latest)]))
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    init_db()
+
+
+@app.cli.command('create-indexes')
+def create_indexes_command():
+    connect()
+    for partition_engine in engines.values():
+        create_indexes(partition_engine)
+
+
+@app.cli.command('rebuild-snapshots')
+def rebuild_snapshots_command():
+    create_app()
+    rebuild_snapshots()
+
+
+@app.before_request
+def set_up_on_first_request():
+    if not ready:
+        create_app()
+
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    if session is not None:
+        session.remove()
+
+
+@app.before_request
+def start_request_metrics():
+    if app.config['METRICS']:
+        request_metrics.start()
+
+
+@app.after_request
+def finish_request_metrics(response):
+    if app.config['METRICS']:
+        request_metrics.finish(request.method, request.url_rule.rule if request.url_rule else 'unmatched')
+    return response
 
 
 def add_new_event(message):
-    message_id = session.query(Message).filter(Message.id == message.get('id')).scalar()
-    event_id = session.query(Event).filter(Event.id == message.get('event').get('id')).scalar()
-    if message_id is None and event_id is None:
+    with partitions.use(message_partition(message)):
+        add_new_events([message])
+
+
+def message_partition(message):
+    if len(partitions) == 1:
+        return DEFAULT
+    # writes go to the database of the event's sport; the message is validated where it is written, one without a
+    # readable sport id fails there in the default one
+    try:
+        return partitions.for_sport(message['event']['sport']['id'])
+    except (KeyError, TypeError):
+        return DEFAULT
+
+
+def existing_ids(column, ids):
+    ids = list(ids)
+    found = set()
+    for i in range(0, len(ids), IN_CHUNK_SIZE):
+        found.update(row[0] for row in session.query(column).filter(column.in_(ids[i:i + IN_CHUNK_SIZE])))
+    return found
+
+
+def existing_odds(market_ids):
+    market_ids = list(market_ids)
+    found = set()
+    for i in range(0, len(market_ids), IN_CHUNK_SIZE):
+        found.update(session.query(Odd.market_id, Odd.selection_id)
+                     .filter(Odd.market_id.in_(market_ids[i:i + IN_CHUNK_SIZE])))
+    return found
+
+
+def market_events(market_ids):
+    market_ids = list(market_ids)
+    found = {}
+    for i in range(0, len(market_ids), IN_CHUNK_SIZE):
+        for event_id, market_id in session.query(event_market.c.EventId, event_market.c.MarketId) \
+                .filter(event_market.c.MarketId.in_(market_ids[i:i + IN_CHUNK_SIZE])):
+            found.setdefault(market_id, []).append(event_id)
+    return found
+
+
+def next_modified(column, updated_at):
+    # Last-Modified has whole seconds, so a write within the second of the previous one moves on to the next second
+    same_second = func.datetime(column) >= updated_at.strftime('%Y-%m-%d %H:%M:%S')
+    return case([(same_second, func.datetime(column, '+1 second'))], else_=updated_at)
+
+
+def bump_event_versions(db_session, event_ids):
+    updated_at = datetime.utcnow()
+    for i in range(0, len(event_ids), IN_CHUNK_SIZE):
+        db_session.query(Event).filter(Event.id.in_(event_ids[i:i + IN_CHUNK_SIZE])) \
+            .update({Event.version: Event.version + 1, Event.updated_at: next_modified(Event.updated_at, updated_at)},
+                    synchronize_session=False)
+
+
+def record_odds_history(db_session, odds):
+    if app.config['ODDS_HISTORY'] and odds:
+        timestamp = datetime.utcnow()
+        db_session.bulk_insert_mappings(OddHistory, [dict(odd, timestamp=timestamp) for odd in odds])
+
+
+def stage_odds(odds):
+    # the index only learns prices once they are committed
+    if app.config['ODDS_INDEX']:
+        session.info.setdefault('odds', []).extend(odds)
+
+
+def reserve_odds(prices):
+    # prices this transaction writes are pending until it ends, nobody skips them as unchanged meanwhile
+    if not app.config['ODDS_INDEX']:
+        return set()
+    unchanged = odds_index.reserve(prices)
+    session.info.setdefault('reserved', []).extend(key for key in prices if key not in unchanged)
+    return unchanged
+
+
+def stage_odds_deltas(odds, events):
+    # only events somebody is streaming are worth encoding
+    deltas = {}
+    for odd in odds:
+        for event_id in events.get(odd['market_id'], ()):
+            if broker.has_subscribers(event_id):
+                deltas.setdefault(event_id, {}).setdefault(odd['market_id'], []).append(
+                    {'id': odd['selection_id'], 'odds': odd['odd']})
+    if deltas:
+        session.info.setdefault('deltas', []).extend(deltas.items())
+
+
+@listens_for(Session, 'after_commit')
+def publish_committed(db_session):
+    odds_index.update(db_session.info.pop('odds', ()))
+    odds_index.release(db_session.info.pop('reserved', ()))
+    for kind, ids in db_session.info.pop('ids', ()):
+        duplicate_filter.add(kind, ids)
+    for event_id, markets in db_session.info.pop('deltas', ()):
+        broker.publish(event_id, encode_odds_delta(event_id, markets))
+
+
+@listens_for(Session, 'after_rollback')
+def discard_uncommitted(db_session):
+    db_session.info.pop('odds', None)
+    odds_index.release(db_session.info.pop('reserved', ()))
+    db_session.info.pop('ids', None)
+    db_session.info.pop('deltas', None)
+
+
+def new_event_ids(messages):
+    # message, event, sport, market and selection ids a batch of NewEvent messages has to look up
+    events = [message.get('event') for message in messages]
+    markets = [market for event in events for market in event.get('markets')]
+    return ({message.get('id') for message in messages}, {event.get('id') for event in events},
+            {event.get('sport').get('id') for event in events}, {market.get('id') for market in markets},
+            {i.get('id') for market in markets for i in market.get('selections')})
+
+
+def new_event_rows(messages, known_messages, known_events, known_sports, known_markets, known_selections,
+                   known_odds):
+    # the known sets are extended in place; returns a result per message and the rows to insert per model
+    rows = {model: [] for model in (Sport, Selection, Market, Odd, Event, Message, event_market)}
+    results = []
+    updated_at = datetime.utcnow()
+    for message in messages:
+        event = message.get('event')
+        if message.get('id') in known_messages or event.get('id') in known_events:
+            log.warning('Cannot add the new event: No valid message or event id')
+            results.append('Duplicate')
+            continue
         try:
-            sport_id = session.query(Sport).filter(Sport.id == message.get('event').get('sport').get('id')).scalar()
-            if sport_id is None:
-                sport = message.get('event').get('sport')
-                new_sport = Sport(id=sport.get('id'), name=sport.get('name'))
-                session.add(new_sport)
-
-            market_id = session.query(Market).filter(
-                Market.id == message.get('event').get('markets')[0].get('id')).scalar()
-            if market_id is None:
-                market = message.get('event').get('markets')[0]
-                selections = market.get('selections')
-                for i in selections:
-                    selection_id = session.query(Selection).filter(Selection.id == i.get('id')).scalar()
-                    if selection_id is None:
-                        new_selection = Selection(id=i.get('id'), name=i.get('name'))
-                        session.add(new_selection)
-
-                    odd = session.query(Odd).filter(
-                        and_(Odd.market_id == market.get('id'), Odd.selection_id == i.get('id'))).scalar()
-                    if odd is None:
-                        new_odds = Odd(market_id=market.get('id'), selection_id=i.get('id'), odd=i.get('odds'))
-                        session.add(new_odds)
-
-                market = message.get('event').get('markets')[0]
-                new_market = Market(id=market.get('id'), name=market.get('name'),
-                                    sport_id=message.get('event').get('sport').get('id'))
-                session.add(new_market)
-
-            event = message.get('event')
-            event_id = event.get('id')
-            event_name = event.get('name')
-            event_time = datetime.strptime(message.get('event').get('startTime'), '%Y-%m-%d %H:%M:%S')
-            new_event = Event(id=event_id, name=event_name,
-                              url='http://127.0.0.1:5000/api/match/{event_id}'.format(event_id=event_id),
-                              start_time=event_time, market_id=market.get('id'))
-            session.add(new_event)
-
-            new_message = Message(id=message.get('id'), message_type='NewEvent',
-                                  event_id=message.get('event').get('id'))
-            session.add(new_message)
-            session.commit()
-        except Exception as e:
-            logging.warning('Failed to add the new event: %s' % e)
-    else:
-        logging.warning('Cannot add the new event: No valid message or event id')
+            event_time = datetime.strptime(event.get('startTime'), '%Y-%m-%d %H:%M:%S')
+        except ValueError as e:
+            log.warning('Failed to add the new event: %s' % e)
+            results.append('Invalid')
+            continue
+        known_messages.add(message.get('id'))
+        known_events.add(event.get('id'))
+
+        sport = event.get('sport')
+        if sport.get('id') not in known_sports:
+            known_sports.add(sport.get('id'))
+            rows[Sport].append(dict(id=sport.get('id'), name=sport.get('name')))
+
+        event_market_ids = set()
+        for market in event.get('markets'):
+            if market.get('id') not in known_markets:
+                known_markets.add(market.get('id'))
+                for i in market.get('selections'):
+                    if i.get('id') not in known_selections:
+                        known_selections.add(i.get('id'))
+                        rows[Selection].append(dict(id=i.get('id'), name=i.get('name')))
+                    if (market.get('id'), i.get('id')) not in known_odds:
+                        known_odds.add((market.get('id'), i.get('id')))
+                        rows[Odd].append(dict(market_id=market.get('id'), selection_id=i.get('id'),
+                                              odd=i.get('odds')))
+                rows[Market].append(dict(id=market.get('id'), name=market.get('name'), sport_id=sport.get('id')))
+            if market.get('id') not in event_market_ids:
+                event_market_ids.add(market.get('id'))
+                rows[event_market].append({'EventId': event.get('id'), 'MarketId': market.get('id')})
+
+        rows[Event].append(dict(id=event.get('id'), name=event.get('name'),
+                                url='http://127.0.0.1:5000/api/match/{event_id}'.format(event_id=event.get('id')),
+                                start_time=event_time, market_id=event.get('markets')[0].get('id'),
+                                version=1, updated_at=updated_at))
+        rows[Message].append(dict(id=message.get('id'), message_type='NewEvent', event_id=event.get('id')))
+        results.append('OK')
+    return results, rows
+
+
+def insert_rows(db_session, rows):
+    for model in (Sport, Selection, Market, Odd, Event, Message):
+        if rows[model]:
+            db_session.bulk_insert_mappings(model, rows[model])
+    if rows[event_market]:
+        db_session.execute(event_market.insert(), rows[event_market])
+    if rows[Event]:
+        db_session.query(DataVersion).filter(DataVersion.name == 'listing') \
+            .update({DataVersion.version: DataVersion.version + 1,
+                     DataVersion.updated_at: next_modified(DataVersion.updated_at, rows[Event][0]['updated_at'])},
+                    synchronize_session=False)
+    record_odds_history(db_session, rows[Odd])
+
+
+def insert_new_events(messages):
+    message_ids, event_ids = new_event_ids(messages)[:2]
+    known_messages = known_ids('message', Message.id, message_ids)
+    known_events = known_ids('event', Event.id, event_ids)
+    # resent messages are dropped before anything else is looked up, a batch of them costs no other query
+    fresh = [message for message in messages
+             if message.get('id') not in known_messages and message.get('event').get('id') not in known_events]
+    if not fresh:
+        log.warning('Cannot add the new events: No valid message or event id')
+        return ['Duplicate'] * len(messages), []
+    sport_ids, market_ids, selection_ids = new_event_ids(fresh)[2:]
+    known_sports = existing_ids(Sport.id, sport_ids)
+    known_markets = existing_ids(Market.id, market_ids)
+    known_selections = existing_ids(Selection.id, selection_ids)
+    known_odds = existing_odds(market_ids - known_markets)
+    results, rows = new_event_rows(messages, known_messages, known_events, known_sports, known_markets,
+                                   known_selections, known_odds)
+    insert_rows(session, rows)
+    stage_odds(rows[Odd])
+    stage_ids('message', [message['id'] for message in rows[Message]])
+    stage_ids('event', [event['id'] for event in rows[Event]])
+    event_ids = [event.get('id') for event in rows[Event]]
+    refresh_snapshots(event_ids)
+    return results, event_ids
+
+
+def add_new_events(messages):
+    try:
+        results, event_ids = insert_new_events(messages)
+        session.commit()
+        match_cache.invalidate(*event_ids)
+    except Exception as e:
+        session.rollback()
+        if retry_verified(e):
+            return verified(add_new_events, messages)
+        log.warning('Failed to add the new events: %s' % e)
+        results = ['Failed'] * len(messages)
+    return results
+
+
+def known_ids(kind, column, ids):
+    if not app.config['DUPLICATE_FILTER'] or session.info.get('verify_ids'):
+        return existing_ids(column, ids)
+    # ids committed lately are duplicates and ids the filter never saw are new, only the rest is looked up
+    seen, possible = duplicate_filter.classify(kind, ids)
+    found = existing_ids(column, possible) if possible else set()
+    duplicate_filter.confirmed(possible, found)
+    return seen | found
+
+
+def stage_ids(kind, ids):
+    if app.config['DUPLICATE_FILTER'] and ids:
+        session.info.setdefault('ids', []).append((kind, ids))
+
+
+def retry_verified(error):
+    # a row written by another process, or behind the API's back, is new to the filter; the primary key catches it
+    return isinstance(error, IntegrityError) and app.config['DUPLICATE_FILTER'] and \
+        not session.info.get('verify_ids')
+
+
+def verified(write, messages):
+    session.info['verify_ids'] = True
+    try:
+        return write(messages)
+    finally:
+        session.info.pop('verify_ids', None)
+
+
+def odds_prices(messages):
+    # later prices for the same selection replace earlier ones, so a run of messages costs one write per odd
+    prices = {}
+    received = 0
+    for message in messages:
+        for market in message.get('event').get('markets'):
+            for i in market.get('selections'):
+                prices[(market.get('id'), i.get('id'))] = i.get('odds')
+                received += 1
+    return prices, received
+
+
+def odds_results(messages, known_markets, known_odds, odds_log=None):
+    results = []
+    for message in messages:
+        markets = {market.get('id'): market for market in message.get('event').get('markets')}
+        if not any(market_id in known_markets for market_id in markets):
+            log.warning('Cannot update adds: No valid market info')
+            results.append(None)
+            continue
+        matched, unmatched = [], []
+        for market_id, market in markets.items():
+            selection_ids = list(dict.fromkeys(i.get('id') for i in market.get('selections')))
+            market_matched = [selection_id for selection_id in selection_ids
+                              if (market_id, selection_id) in known_odds]
+            market_unmatched = [selection_id for selection_id in selection_ids
+                                if (market_id, selection_id) not in known_odds]
+            matched.extend(market_matched)
+            unmatched.extend(market_unmatched)
+            if odds_log is not None and market_id in known_markets:
+                odds_log.record(market_id, len(market_matched), len(market_unmatched))
+        results.append({'matched': matched, 'unmatched': unmatched})
+    return results
+
+
+def write_odds_updates(messages):
+    prices, received = odds_prices(messages)
+    unchanged = reserve_odds(prices)
+    known_markets = {market_id for market_id, selection_id in unchanged}
+    known_odds = set(unchanged)
+    lookup = {market_id for market_id, selection_id in prices if (market_id, selection_id) not in unchanged}
+    if lookup:
+        known_markets.update(existing_ids(Market.id, lookup - known_markets))
+        known_odds.update(existing_odds(lookup & known_markets))
+
+    updates = [dict(market_id=market_id, selection_id=selection_id, odd=odd)
+               for (market_id, selection_id), odd in prices.items()
+               if (market_id, selection_id) in known_odds and (market_id, selection_id) not in unchanged]
+    if updates:
+        session.bulk_update_mappings(Odd, updates)
+        record_odds_history(session, updates)
+        stage_odds(updates)
+    odds_index.count(skipped=len(unchanged), coalesced=received - len(prices), written=len(updates))
+    events = market_events({odd['market_id'] for odd in updates})
+    event_ids = list({event_id for ids in events.values() for event_id in ids})
+    bump_event_versions(session, event_ids)
+    refresh_snapshots(event_ids)
+    stage_odds_deltas(updates, events)
+    return odds_results(messages, known_markets, known_odds, odds_log), event_ids
+
+
+def write_odds(message):
+    results, event_ids = write_odds_updates([message])
+    return results[0], event_ids
 
 
 def update_odds(message):
-    market = message.get('event').get('markets')[0]
-    market_id = session.query(Market).filter(Market.id == market.get('id')).scalar()
-    if market and market_id:
-        market_id = market.get('id')
-        selections = market.get('selections')
-        for i in selections:
-            try:
-                selection_id = i.get('id')
-                odd_value = i.get('odds')
-                session.query(Odd). \
-                    filter(and_(Odd.selection_id == selection_id, Odd.market_id == market_id)). \
-                    update({"odd": odd_value})
-                logging.info('An odd with market with Id: {market_id} and selection with Id: {selection_id} is '
-                             'updated to {odd_value}.'.format(market_id=market_id, selection_id=selection_id,
-                                                              odd_value=odd_value))
-            except Exception as e:
-                logging.warning('Failed to update an odd: %s' % e)
+    with partitions.use(message_partition(message)):
+        try:
+            updated, event_ids = write_odds(message)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            log.warning('Failed to update odds: %s' % e)
+            return {'matched': [], 'unmatched': [i.get('id') for market in message.get('event').get('markets')
+                                                 for i in market.get('selections')]}
+    match_cache.invalidate(*event_ids)
+    return updated
+
+
+def write_messages(messages):
+    results = [None] * len(messages)
+    event_ids = []
+    new_events = []
+    odds_updates = []
+
+    def flush_new_events():
+        if new_events:
+            new_results, new_event_ids = insert_new_events([messages[i] for i in new_events])
+            for index, result in zip(new_events, new_results):
+                results[index] = result
+            event_ids.extend(new_event_ids)
+            del new_events[:]
+
+    def flush_odds_updates():
+        if odds_updates:
+            updated_results, updated_event_ids = write_odds_updates([messages[i] for i in odds_updates])
+            for index, updated in zip(odds_updates, updated_results):
+                results[index] = 'Invalid market' if updated is None else dict(updated, result='OK')
+            event_ids.extend(updated_event_ids)
+            del odds_updates[:]
+
+    for index, message in enumerate(messages):
+        error = message_error(message)
+        if error is not None:
+            results[index] = {'result': 'Can not parse the message', 'error': error}
+        elif message.get('message_type') == 'NewEvent':
+            flush_odds_updates()
+            new_events.append(index)
+        elif message.get('message_type') == 'UpdateOdds':
+            flush_new_events()
+            odds_updates.append(index)
+            if not app.config['ODDS_COALESCE']:
+                flush_odds_updates()
+        else:
+            log.error('Invalid message type')
+            results[index] = 'Invalid message type'
+    flush_new_events()
+    flush_odds_updates()
+    return results, event_ids
+
+
+def commit_messages(messages):
+    if len(partitions) == 1:
+        return commit_partition_messages(messages)
+    # one transaction per partition, a batch is only atomic within a sport's database
+    groups = {}
+    for index, message in enumerate(messages):
+        groups.setdefault(message_partition(message), []).append(index)
+    results, event_ids = [None] * len(messages), []
+    for name, indexes in groups.items():
+        with partitions.use(name):
+            partition_results, partition_event_ids = commit_partition_messages([messages[i] for i in indexes])
+        for index, result in zip(indexes, partition_results):
+            results[index] = result
+        event_ids.extend(partition_event_ids)
+    return results, event_ids
+
+
+def commit_partition_messages(messages):
+    try:
+        results, event_ids = write_messages(messages)
         session.commit()
-    else:
-        logging.warning('Cannot update adds: No valid market info')
+    except Exception as e:
+        session.rollback()
+        if retry_verified(e):
+            return verified(commit_partition_messages, messages)
+        if len(messages) == 1:
+            log.warning('Failed to apply the message: %s' % e)
+            return ['Failed'], []
+        # retry one by one so a single bad message does not fail the whole batch
+        log.warning('Failed to apply a batch of %d messages, retrying one by one: %s' % (len(messages), e))
+        results, event_ids = [], []
+        for message in messages:
+            result, message_event_ids = commit_partition_messages([message])
+            results.extend(result)
+            event_ids.extend(message_event_ids)
+    return results, event_ids
+
+
+def apply_messages(messages):
+    results, event_ids = commit_messages(messages)
+    match_cache.invalidate(*event_ids)
+    return results
+
+
+def apply_queued_messages(messages):
+    try:
+        apply_messages(messages)
+    finally:
+        session.remove()
+
+
+def apply_forwarded_messages(messages):
+    try:
+        return commit_messages(messages)
+    finally:
+        session.remove()
+
+
+def forward_messages(messages):
+    # other readers keep serving their cached copy until MATCH_CACHE_TTL
+    results, event_ids = writer_client.send(messages)
+    match_cache.invalidate(*event_ids)
+    return results
+
+
+def render_matches(event_ids):
+    event_ids = list(event_ids)
+    rows = {}
+    for i in range(0, len(event_ids), IN_CHUNK_SIZE):
+        for row in matches_rows_query(session, event_ids[i:i + IN_CHUNK_SIZE]):
+            rows.setdefault(row[0], []).append(row)
+    return {event_id: encode_match(res) for event_id, res in rows.items()}
+
+
+def event_versions(event_ids):
+    event_ids = list(event_ids)
+    found = {}
+    for i in range(0, len(event_ids), IN_CHUNK_SIZE):
+        found.update(session.query(Event.id, Event.version).filter(Event.id.in_(event_ids[i:i + IN_CHUNK_SIZE])))
+    return found
+
+
+def write_snapshots(event_ids):
+    updated_at = datetime.utcnow()
+    versions = event_versions(event_ids)
+    snapshots = [{'EventId': event_id, 'Document': document, 'Version': versions.get(event_id),
+                  'UpdatedAt': updated_at}
+                 for event_id, document in render_matches(event_ids).items()]
+    if snapshots:
+        session.execute(MatchSnapshot.__table__.insert().prefix_with('OR REPLACE'), snapshots)
+
+
+def refresh_snapshots(event_ids):
+    if app.config['MATCH_SNAPSHOTS']:
+        write_snapshots(event_ids)
+
+
+def rebuild_snapshots():
+    for name in partitions.engines:
+        with partitions.use(name):
+            session.execute(MatchSnapshot.__table__.delete())
+            event_ids = [row[0] for row in session.query(Event.id)]
+            for i in range(0, len(event_ids), IN_CHUNK_SIZE):
+                write_snapshots(event_ids[i:i + IN_CHUNK_SIZE])
+            session.commit()
+    match_cache.clear()
+
+
+def stream_matches(statement, params):
+    # partitions one after the other, so only for listings without an ordering
+    for partition_engine in engines.values():
+        connection = partition_engine.connect().execution_options(stream_results=True)
+        try:
+            for row in connection.execute(statement, params):
+                yield encode_match_line(row)
+        finally:
+            connection.close()
+
+
+def query_matches(statement, params, ordering):
+    results = partitions.map(lambda: partitions.engine().execute(statement, params).fetchall())
+    if len(results) == 1:
+        return results[0][1]
+    return merge_matches([res for name, res in results], ordering, params.get('limit'))
+
+
+def listing_version():
+    versions = [version for name, version in partitions.map(
+        lambda: partitions.engine().execute(listing_version_statement).first())]
+    if len(versions) == 1:
+        return versions[0]
+    # every partition only counts up, so the sum changes whenever one of them does
+    updated = [updated_at for version, updated_at in versions if updated_at is not None]
+    return sum(version for version, updated_at in versions), max(updated) if updated else None
+
 
+def find_event(id):
+    # the partition holding the event, and its version
+    for name, version in partitions.map(lambda: event_version_query(session, id)):
+        if version is not None:
+            return name, version
+    return DEFAULT, None
 
-def encode_match(res):
-    event_id = res[0][0]
-    event_url = res[0][1]
-    event_name = res[0][2]
-    event_start_time = res[0][3].strftime('%Y-%m-%d %H:%M:%S')
 
-    sport = res[0][4]
-    sport_id = sport.id
-    sport_name = sport.name
-    market_id = res[0][5]
-    market_name = res[0][6]
+def wants_ndjson():
+    return any(mimetype == 'application/x-ndjson' for mimetype, quality in request.accept_mimetypes if quality)
 
-    selections = list(map(lambda x: dict(id=x[7], name=x[8], odds=x[9]), res))
 
-    match_json = json.dumps({'id': event_id, 'url': event_url, 'name': event_name, 'startTime': event_start_time,
-                             'sport': {'id': sport_id, 'name': sport_name},
-                             'markets': [{'id': market_id, 'name': market_name, 'selections': selections}]})
-    return match_json
+def entity_tag(version, updated_at):
+    return '%d-%s' % (version, updated_at.strftime('%Y%m%d%H%M%S%f') if updated_at else '0')
 
 
-def encode_matches(res):
-    matches = []
-    for i in range(len(res)):
-        match_id = res[i][0]
-        match_url = res[i][1]
-        match_name = res[i][2]
-        match_start_time = res[i][3][:19]
-        match = {'id': match_id, 'url': match_url, 'name': match_name, 'startTime': match_start_time}
-        matches.append(match)
+def validators(etag, updated_at, vary='Accept-Encoding'):
+    headers = {'ETag': quote_etag(etag, weak=True), 'Vary': vary}
+    if updated_at is not None:
+        headers['Last-Modified'] = http_date(updated_at)
+    return headers
 
-    matches_json = json.dumps(matches)
-    return matches_json
+
+def not_modified(etag, updated_at):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and updated_at is not None:
+        return updated_at.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def wants_gzip(body):
+    return len(body) >= app.config['GZIP_MIN_SIZE'] and request.accept_encodings['gzip']
+
+
+def make_response(body, headers, mimetype=None, compressed=None):
+    if wants_gzip(body):
+        body = compressed if compressed is not None else gzip.compress(body.encode(), app.config['GZIP_LEVEL'])
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, headers=headers, mimetype=mimetype)
+
+
+def cache_match(id, match_json, etag, updated_at, cache_version):
+    # the compressed body is kept next to the JSON, so a cache hit does not compress it again
+    compressed = gzip.compress(match_json.encode(), app.config['GZIP_LEVEL']) if wants_gzip(match_json) else None
+    match_cache.set(id, (match_json, etag, updated_at, compressed), cache_version)
+    return make_response(match_json, validators(etag, updated_at), compressed=compressed)
 
 
 @app.route('/api/match/<int:id>', methods=['GET'])
 def get_match(id):
     try:
-        res = session.query(Event.id, Event.url, Event.name, Event.start_time, Sport, Market.id,
-                            Market.name, Selection.id, Selection.name, Odd.odd) \
-            .join(Market, Market.id == Event.market_id) \
-            .join(Sport, Sport.id == Market.sport_id) \
-            .join(Odd, Odd.market_id == Market.id) \
-            .join(Selection, Selection.id == Odd.selection_id) \
-            .filter(Event.id == id).all()
+        if request.if_none_match or request.if_modified_since:
+            # primary key lookup only, the join runs when the client copy is stale
+            partition, version = find_event(id)
+            if version is not None and not_modified(entity_tag(*version), version[1]):
+                return Response(status=304, headers=validators(entity_tag(*version), version[1]))
+
+        cached = match_cache.get(id)
+        if cached is not None:
+            match_json, etag, updated_at, compressed = cached
+            return make_response(match_json, validators(etag, updated_at), compressed=compressed)
+
+        cache_version = match_cache.version
+        # read before the match so the tag can only be older than the body, never newer
+        partition, version = find_event(id)
+        if version is None:
+            return 'No match with current match id'
+        etag, updated_at = entity_tag(*version), version[1]
+
+        with partitions.use(partition):
+            if app.config['MATCH_SNAPSHOTS']:
+                # a write made while snapshots were off, or by another server, left the snapshot behind the event
+                match_json = session.query(MatchSnapshot.document) \
+                    .filter(MatchSnapshot.event_id == id, MatchSnapshot.version == version[0]).scalar()
+                if match_json is not None:
+                    return cache_match(id, match_json, etag, updated_at, cache_version)
+
+            res = match_query(session, id).all()
 
         if res:
-            return encode_match(res)
+            with request_metrics.serializing():
+                match_json = encode_match(res)
+            return cache_match(id, match_json, etag, updated_at, cache_version)
         else:
             return 'No match with current match id'
     except Exception as e:
         return 'Exception:%s' % e
 
 
+def stream_events(subscription):
+    try:
+        yield ': subscribed\n\n'
+        while not subscription.dropped:
+            message = subscription.get(app.config['STREAM_KEEPALIVE'])
+            if message is None:
+                # comments keep proxies from timing the stream out and reveal disconnected clients
+                yield ': keepalive\n\n'
+            elif not subscription.dropped:
+                yield 'event: odds\ndata: %s\n\n' % message
+        yield 'event: dropped\ndata: {}\n\n'
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@app.route('/api/match/<int:id>/stream', methods=['GET'])
+def stream_match(id):
+    if app.config['ROLE'] == 'reader':
+        # a read-only worker never commits, its subscribers would only ever get keepalives
+        return 'The odds stream is not served by read-only workers', 404
+    return Response(stream_events(broker.subscribe(id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/stream', methods=['GET'])
+def stream_stats():
+    return json.dumps(broker.stats())
+
+
+@app.route('/api/cache', methods=['GET', 'DELETE'])
+def match_cache_stats():
+    if request.method == 'DELETE':
+        match_cache.clear()
+        if app.config['TEST_RESET']:
+            # only for a server under test, whose rows are changed behind its back
+            odds_index.clear()
+            duplicate_filter.clear_recent()
+    return json.dumps(match_cache.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/match/', methods=['GET'])
 def get_matches():
     try:
         sport = request.args.get('sport')
         ordering = request.args.get('ordering')
         name = request.args.get('name')
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit')
+        if limit is not None:
+            limit = min(int(limit), app.config['MATCHES_MAX_PAGE_SIZE'])
+        elif cursor is not None:
+            limit = app.config['MATCHES_PAGE_SIZE']
+
+        statement, params = matches_query(sport, name, ordering, limit, cursor)
+
+        version, updated_at = listing_version()
+        etag = entity_tag(version, updated_at)
+        # JSON or NDJSON depending on Accept, under the same tag
+        headers = validators(etag, updated_at, 'Accept, Accept-Encoding')
+        if not_modified(etag, updated_at):
+            return Response(status=304, headers=headers)
+
+        if limit is None:
+            if wants_ndjson() and (len(partitions) == 1 or not ordering):
+                return Response(stream_matches(statement, params), mimetype='application/x-ndjson', headers=headers)
+
+            res = query_matches(statement, params, ordering)
+
+            if wants_ndjson():
+                with request_metrics.serializing():
+                    return make_response(encode_matches_ndjson(res), headers, 'application/x-ndjson')
+            if res:
+                with request_metrics.serializing():
+                    return make_response(encode_matches(res), headers)
+            else:
+                return 'No match on current query conditions'
 
-        sql = 'select event.id, event.url, event.name, event.startTime from event'
-
-        if sport:
-            sql += ''' join market on market.id = event.market_id
-                      join sport on sport.id = market.sportId
-                                    and lower(sport.name) =  '{sport_name}' '''.format(sport_name=sport.lower())
-        if name:
-            sql += " where event.name = '{event_name}'".format(event_name=name)
-
-        if ordering:
-            sql += ' order by {ordering}'.format(ordering=ordering)
-            if ordering.lower() == 'starttime':
-                sql += ' desc'
-
-        res = engine.execute(sql).fetchall()
+        res = query_matches(statement, params, ordering)
+        if len(res) > limit:
+            res = res[:limit]
+            headers['X-Next-Cursor'] = encode_cursor(res[-1].cursor_start_time, res[-1][0])
 
-        if res:
-            return encode_matches(res)
-        else:
-            return 'No match on current query conditions'
+        with request_metrics.serializing():
+            if wants_ndjson():
+                return make_response(encode_matches_ndjson(res), headers, 'application/x-ndjson')
+            return make_response(encode_matches(res), headers)
     except Exception:
         return 'Cannot complete the query'
 
 
-def validate_date_type(message):
-    validation = isinstance(message.get('id'), int) \
-                 & isinstance(message.get('message_type'), str)\
-                 & isinstance(message.get('event').get('id'), int) \
-                 & isinstance(message.get('event').get('name'), str) \
-                 & isinstance(message.get('event').get('startTime'), str) \
-                 & isinstance(message.get('event').get('sport').get('id'), int) \
-                 & isinstance(message.get('event').get('sport').get('name'), str)
-
-    markets = message.get('event').get('markets')
-    if markets and validation:
-        market = markets[0]
-        validation = validation & isinstance(market.get('id'), int) \
-                     & isinstance(market.get('name'), str)
-
-        selections = market.get('selections')
-        for i in selections:
-            validation = validation & isinstance(i.get('id'), int) \
-                         & isinstance(i.get('name'), str) \
-                         & isinstance(i.get('odds'), float)
-    else:
-        validation = False
-    return validation
+@app.route('/api/odds/<int:market_id>/<int:selection_id>', methods=['GET'])
+def get_odds_history(market_id, selection_id):
+    try:
+        start = request.args.get('from')
+        end = request.args.get('to')
+        limit = request.args.get('limit')
+        start = datetime.fromisoformat(start) if start else None
+        end = datetime.fromisoformat(end) if end else None
+        limit = int(limit) if limit else -1
+    except ValueError:
+        return 'Invalid time window'
+    try:
+        # the market lives in one partition, the others answer with nothing
+        res = [row for name, rows in partitions.map(
+            lambda: odds_history_query(session, market_id, selection_id, start, end, limit).fetchall())
+               for row in rows]
+        with request_metrics.serializing():
+            return Response(encode_odds_history(res), mimetype='application/json')
+    except Exception:
+        return 'Cannot complete the query'
 
 
 @app.route('/api/external_providers', methods=['POST', 'PUT'])
 def parse_message():
-    if validate_date_type(request.json):
+    error = message_error(request.json)
+    if error is None:
         try:
             message_type = request.json.get('message_type')
-            if message_type == 'NewEvent':
+            if message_type in ('NewEvent', 'UpdateOdds') and app.config['ROLE'] == 'reader':
+                forward_messages([request.json])
+                return 'OK'
+            elif message_type in ('NewEvent', 'UpdateOdds') and app.config['INGEST_ASYNC']:
+                if ingest_queue.put(request.json):
+                    return 'Accepted', 202
+                return 'Queue is full', 503
+            elif message_type == 'NewEvent':
                 add_new_event(request.json)
                 return 'OK'
             elif message_type == 'UpdateOdds':
@@ -211,13 +906,73 @@ def parse_message():
                 return 'OK'
             else:
                 error_message = 'Invalid message type'
-                logging.error(error_message)
+                log.error(error_message)
                 return error_message
+        except WriterUnavailable as e:
+            log.warning('Cannot forward the message: %s' % e)
+            return 'Writer unavailable', 503
         except Exception as e:
             return 'Exception:%s' % e
     else:
+        log.warning('Cannot parse the message: invalid %s' % error)
         return 'Can not parse the message'
 
 
+def load_messages(body):
+    body = body.strip()
+    if body.startswith('['):
+        return json.loads(body)
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+
+def enqueue_message(message):
+    error = message_error(message)
+    if error is not None:
+        return {'result': 'Can not parse the message', 'error': error}
+    if message.get('message_type') not in ('NewEvent', 'UpdateOdds'):
+        log.error('Invalid message type')
+        return 'Invalid message type'
+    if not ingest_queue.put(message):
+        return 'Queue is full'
+    return 'Accepted'
+
+
+@app.route('/api/ingest', methods=['GET'])
+def ingest_stats():
+    return json.dumps(dict(ingest_queue.stats(), odds=odds_index.stats(), duplicates=duplicate_filter.stats()))
+
+
+@app.route('/api/external_providers/batch', methods=['POST', 'PUT'])
+def parse_messages():
+    try:
+        messages = load_messages(request.get_data(as_text=True))
+    except ValueError:
+        return 'Can not parse the message'
+    if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+        return 'Can not parse the message'
+
+    if app.config['ROLE'] == 'reader':
+        try:
+            return format_results(messages, forward_messages(messages))
+        except WriterUnavailable as e:
+            log.warning('Cannot forward %d messages: %s' % (len(messages), e))
+            return 'Writer unavailable', 503
+
+    if app.config['INGEST_ASYNC']:
+        results = [enqueue_message(message) for message in messages]
+        return format_results(messages, results), 202
+
+    results = apply_messages(messages)
+    return format_results(messages, results)
+
+
+def format_results(messages, results):
+    return json.dumps([dict(result, id=message.get('id')) if isinstance(result, dict)
+                       else {'id': message.get('id'), 'result': result}
+                       for message, result in zip(messages, results)])
+
+
 if __name__ == '__main__':
-    app.run()
+    # let SIGTERM run the atexit hooks so queued messages are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    create_app().run(threaded=True)
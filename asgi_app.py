@@ -0,0 +1,235 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from config import Config
+from database import make_async_engine
+from encoders import encode_match, encode_matches
+from logging_config import configure_logging
+from models import *
+from queries import encode_cursor, match_statement, matches_query
+import app as api
+from validation import message_error
+from urllib.parse import parse_qsl
+import json
+import logging
+import re
+
+config = {name: getattr(Config, name) for name in dir(Config) if name.isupper()}
+log = logging.getLogger('ingest')
+# created on lifespan startup, so importing the module touches neither the database nor the log file
+engine = Session = None
+
+IN_CHUNK_SIZE = 500
+
+event_table = Event.__table__
+odd_table = Odd.__table__
+
+
+async def start():
+    global engine, Session
+    configure_logging(config)
+    engine = make_async_engine(config)
+    Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    if config['SCHEMA_CHECK']:
+        async with engine.begin() as connection:
+            await connection.run_sync(setup_database)
+
+
+def setup_database(connection):
+    Base.metadata.create_all(connection)
+    add_missing_columns(connection)
+    create_indexes(connection)
+    backfill_event_markets(connection)
+    create_data_versions(connection)
+
+
+async def existing_ids(session, column, ids):
+    ids = list(ids)
+    found = set()
+    for i in range(0, len(ids), IN_CHUNK_SIZE):
+        found.update((await session.execute(select([column]).where(column.in_(ids[i:i + IN_CHUNK_SIZE])))).scalars())
+    return found
+
+
+async def existing_odds(session, market_ids):
+    market_ids = list(market_ids)
+    found = set()
+    for i in range(0, len(market_ids), IN_CHUNK_SIZE):
+        found.update(tuple(row) for row in await session.execute(
+            select([odd_table.c.MarketId, odd_table.c.SelectionId])
+            .where(odd_table.c.MarketId.in_(market_ids[i:i + IN_CHUNK_SIZE]))))
+    return found
+
+
+async def add_new_event(session, message):
+    # the rows are built and written by the same code as in app.py, only the lookups are awaited here
+    message_ids, event_ids, sport_ids, market_ids, selection_ids = api.new_event_ids([message])
+    known_messages = await existing_ids(session, Message.__table__.c.Id, message_ids)
+    known_events = await existing_ids(session, event_table.c.Id, event_ids)
+    if known_messages or known_events:
+        log.warning('Cannot add the new event: No valid message or event id')
+        return
+    known_sports = await existing_ids(session, Sport.__table__.c.Id, sport_ids)
+    known_markets = await existing_ids(session, Market.__table__.c.Id, market_ids)
+    known_selections = await existing_ids(session, Selection.__table__.c.Id, selection_ids)
+    known_odds = await existing_odds(session, market_ids - known_markets)
+    _, rows = api.new_event_rows([message], known_messages, known_events, known_sports, known_markets,
+                                 known_selections, known_odds)
+    await session.run_sync(api.insert_rows, rows)
+    await session.commit()
+
+
+def write_odds(db_session, updates, event_ids):
+    db_session.bulk_update_mappings(Odd, updates)
+    api.record_odds_history(db_session, updates)
+    api.bump_event_versions(db_session, event_ids)
+
+
+async def update_odds(session, message):
+    prices, _ = api.odds_prices([message])
+    known_markets = await existing_ids(session, Market.__table__.c.Id, {market_id for market_id, _ in prices})
+    if not known_markets:
+        log.warning('Cannot update adds: No valid market info')
+        return
+    known_odds = await existing_odds(session, known_markets)
+    updates = [dict(market_id=market_id, selection_id=selection_id, odd=odd)
+               for (market_id, selection_id), odd in prices.items() if (market_id, selection_id) in known_odds]
+    if updates:
+        event_ids = list((await session.execute(
+            select([event_market.c.EventId]).where(event_market.c.MarketId.in_(
+                list({odd['market_id'] for odd in updates}))))).scalars())
+        await session.run_sync(write_odds, updates, event_ids)
+    await session.commit()
+
+
+async def get_match(request, id):
+    try:
+        async with Session() as session:
+            res = (await session.execute(match_statement, {'event_id': id})).all()
+        if res:
+            return encode_match(res)
+        return 'No match with current match id'
+    except Exception as e:
+        return 'Exception:%s' % e
+
+
+async def get_matches(request):
+    try:
+        args = request['args']
+        limit = args.get('limit')
+        if limit is not None:
+            limit = min(int(limit), config['MATCHES_MAX_PAGE_SIZE'])
+        elif args.get('cursor') is not None:
+            limit = config['MATCHES_PAGE_SIZE']
+
+        statement, params = matches_query(args.get('sport'), args.get('name'), args.get('ordering'), limit,
+                                          args.get('cursor'))
+        async with Session() as session:
+            res = (await session.execute(statement, params)).all()
+
+        if limit is None:
+            if res:
+                return encode_matches(res)
+            return 'No match on current query conditions'
+
+        headers = []
+        if len(res) > limit:
+            res = res[:limit]
+            headers.append(('X-Next-Cursor', encode_cursor(res[-1].cursor_start_time, res[-1][0])))
+        return 200, encode_matches(res), headers
+    except Exception:
+        return 'Cannot complete the query'
+
+
+async def parse_message(request):
+    message = None
+    if request['content_type'] == 'application/json':
+        try:
+            message = json.loads(request['body'])
+        except ValueError:
+            return 400, 'Bad Request', []
+    error = message_error(message)
+    if error is not None:
+        log.warning('Cannot parse the message: invalid %s' % error)
+        return 'Can not parse the message'
+    try:
+        async with Session() as session:
+            try:
+                if message.get('message_type') == 'NewEvent':
+                    await add_new_event(session, message)
+                elif message.get('message_type') == 'UpdateOdds':
+                    await update_odds(session, message)
+                else:
+                    error_message = 'Invalid message type'
+                    log.error(error_message)
+                    return error_message
+            except Exception as e:
+                await session.rollback()
+                log.warning('Failed to apply the message: %s' % e)
+        return 'OK'
+    except Exception as e:
+        return 'Exception:%s' % e
+
+
+ROUTES = [
+    (re.compile(r'^/api/match/(\d+)$'), ('GET',), lambda request, id: get_match(request, int(id))),
+    (re.compile(r'^/api/match/$'), ('GET',), get_matches),
+    (re.compile(r'^/api/external_providers$'), ('POST', 'PUT'), parse_message),
+]
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_response(send, status, body, headers=()):
+    body = body.encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/html; charset=utf-8'),
+                            (b'content-length', str(len(body)).encode())] +
+                           [(name.lower().encode(), value.encode()) for name, value in headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await start()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    for pattern, methods, handler in ROUTES:
+        match = pattern.match(scope['path'])
+        if match:
+            break
+    else:
+        return await send_response(send, 404, 'Not Found')
+    if scope['method'] not in methods:
+        return await send_response(send, 405, 'Method Not Allowed')
+
+    headers = dict(scope['headers'])
+    request = {'args': dict(parse_qsl(scope['query_string'].decode())),
+               'content_type': headers.get(b'content-type', b'').decode().split(';')[0].strip(),
+               'body': await read_body(receive)}
+    result = await handler(request, *match.groups())
+    if isinstance(result, str):
+        result = (200, result, [])
+    await send_response(send, *result)
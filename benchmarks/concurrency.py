@@ -0,0 +1,144 @@
+"""Concurrent connections sustained by the threaded Flask app vs the ASGI variant (asgi_app.py).
+
+Each server is started as a subprocess on a throwaway database and seeded with a synthetic feed.
+Then, for each concurrency level, that many asyncio clients hold a connection open, send one GET
+(a match or a listing page) and read the whole response, over and over for --seconds. The report
+gives throughput, latency percentiles, errors and timeouts per level.
+
+The ASGI server needs the packages in requirements-async.txt (uvicorn, aiosqlite, SQLAlchemy 1.4).
+
+Run from the repository root:
+
+    python -m benchmarks.concurrency --servers flask asgi --concurrency 16 64 256 1024 --output concurrency.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.feed import Feed
+
+SERVERS = {
+    'flask': lambda port: [sys.executable, '-m', 'flask', 'run', '--port', str(port), '--with-threads'],
+    'asgi': lambda port: [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--port', str(port),
+                          '--log-level', 'warning', '--backlog', '4096'],
+}
+
+
+def start_server(name, port):
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ, FLASK_APP='app.py', DATABASE_URL='sqlite:///%s' % os.path.join(directory, 'bench.sqlite3'),
+               LOG_FILE=os.path.join(directory, 'api.log'))
+    process = subprocess.Popen(SERVERS[name](port), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('%s server did not start on port %d' % (name, port))
+
+
+def seed(port, feed, events):
+    url = 'http://127.0.0.1:%d/api/external_providers' % port
+    with requests.Session() as session:
+        for _ in range(events):
+            session.post(url, data=json.dumps(feed.new_event()), headers={'Content-type': 'application/json'})
+
+
+async def fetch(port, path, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    try:
+        writer.write(('GET %s HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n' % path).encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    return response.split(b' ', 2)[1:2] == [b'200']
+
+
+async def client(port, paths, deadline, timeout, latencies, counts):
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            ok = await fetch(port, random.choice(paths), timeout)
+        except asyncio.TimeoutError:
+            counts['timeouts'] += 1
+            continue
+        except OSError:
+            counts['errors'] += 1
+            await asyncio.sleep(0.01)
+            continue
+        latencies.append(time.perf_counter() - started)
+        counts['ok' if ok else 'errors'] += 1
+
+
+async def run_level(port, paths, concurrency, seconds, timeout):
+    latencies = []
+    counts = {'ok': 0, 'errors': 0, 'timeouts': 0}
+    deadline = time.monotonic() + seconds
+    started = time.perf_counter()
+    await asyncio.gather(*[client(port, paths, deadline, timeout, latencies, counts) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(fraction):
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000 if latencies else None
+
+    return dict(counts, concurrency=concurrency, seconds=elapsed, throughput=counts['ok'] / elapsed,
+                p50_ms=percentile(0.50), p95_ms=percentile(0.95), p99_ms=percentile(0.99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', nargs='+', default=sorted(SERVERS), choices=sorted(SERVERS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[16, 64, 256, 1024])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--timeout', type=float, default=10, help='seconds before a request counts as timed out')
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for offset, name in enumerate(args.servers):
+        port = args.port + offset
+        process = start_server(name, port)
+        try:
+            feed = Feed(seed=0)
+            seed(port, feed, args.events)
+            paths = ['/api/match/%d' % event['id'] for event in feed.events] + \
+                    ['/api/match/?sport=%s&limit=20' % sport['name'] for sport in feed.sports]
+            results[name] = []
+            for concurrency in args.concurrency:
+                result = asyncio.run(run_level(port, paths, concurrency, args.seconds, args.timeout))
+                results[name].append(result)
+                print('%-6s %6d connections %9.1f req/s  p50 %s  p99 %s ms  %d errors  %d timeouts' % (
+                    name, concurrency, result['throughput'],
+                    '%8.2f' % result['p50_ms'] if result['p50_ms'] is not None else '       -',
+                    '%8.2f' % result['p99_ms'] if result['p99_ms'] is not None else '       -',
+                    result['errors'], result['timeouts']))
+        finally:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
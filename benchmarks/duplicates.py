@@ -0,0 +1,97 @@
+"""Cost of rejecting resent NewEvent messages with and without the in-memory duplicate filter.
+
+The app runs in-process on a throwaway database seeded with --events events. Each round posts a mix of
+resent messages (--duplicates of them) and new ones through POST /api/external_providers/batch, once with
+DUPLICATE_FILTER off (two existence queries per batch) and once with it on. The report gives messages per
+second and the statements executed per message, followed by the filter's memory footprint and its
+measured false-positive rate for --ids ids.
+
+Run from the repository root:
+
+    python -m benchmarks.duplicates --events 5000 --rounds 2000 --duplicates 0.8 --ids 1000000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import event
+
+directory = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///%s' % os.path.join(directory, 'bench.sqlite3')
+os.environ['LOG_FILE'] = os.path.join(directory, 'api.log')
+
+import app
+from benchmarks.feed import Feed
+from duplicates import DuplicateFilter
+
+
+def post_round(client, feed, sent, rounds, duplicates, counter):
+    started = time.perf_counter()
+    statements = counter['statements']
+    for _ in range(rounds):
+        message = random.choice(sent) if random.random() < duplicates else feed.new_event()
+        client.post('/api/external_providers/batch', data=json.dumps([message]), content_type='application/json')
+    elapsed = time.perf_counter() - started
+    return {'messages_per_second': rounds / elapsed,
+            'statements_per_message': (counter['statements'] - statements) / rounds}
+
+
+def false_positive_rate(ids, probes, error_rate):
+    duplicates = DuplicateFilter(capacity=ids, error_rate=error_rate, recent_size=0)
+    duplicates.add('message', range(ids), recent=False)
+    seen, possible = duplicates.classify('message', range(ids, ids + probes))
+    return {'ids': ids, 'memory_bytes': duplicates.memory(), 'bits_per_id': duplicates.bloom.size / ids,
+            'hashes': duplicates.bloom.hashes, 'expected_false_positive_rate': duplicates.bloom.expected_error_rate(),
+            'false_positive_rate': len(possible) / probes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=1000)
+    parser.add_argument('--duplicates', type=float, default=0.8, help='share of resent messages')
+    parser.add_argument('--ids', type=int, default=1000000, help='ids in the filter for the false-positive probe')
+    parser.add_argument('--probes', type=int, default=100000)
+    parser.add_argument('--error-rate', type=float, default=0.001)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    app.create_app()
+    client = app.app.test_client()
+    counter = {'statements': 0}
+
+    def count(*arguments):
+        counter['statements'] += 1
+
+    for partition_engine in app.engines.values():
+        event.listen(partition_engine, 'before_cursor_execute', count)
+
+    feed = Feed(seed=0)
+    sent = [feed.new_event() for _ in range(args.events)]
+    for i in range(0, len(sent), 500):
+        client.post('/api/external_providers/batch', data=json.dumps(sent[i:i + 500]), content_type='application/json')
+
+    results = {}
+    for name, enabled in (('database', False), ('filter', True)):
+        app.app.config['DUPLICATE_FILTER'] = enabled
+        results[name] = post_round(client, feed, sent, args.rounds, args.duplicates, counter)
+        print('%-9s %9.1f msg/s  %5.2f statements/msg' % (
+            name, results[name]['messages_per_second'], results[name]['statements_per_message']))
+
+    results['filter_stats'] = app.duplicate_filter.stats()
+    results['false_positives'] = false_positive_rate(args.ids, args.probes, args.error_rate)
+    print('%d ids: %.1f MB, %.1f bits and %d hashes per id, false positives %.4f%% (expected %.4f%%)' % (
+        args.ids, results['false_positives']['memory_bytes'] / 2 ** 20, results['false_positives']['bits_per_id'],
+        results['false_positives']['hashes'], results['false_positives']['false_positive_rate'] * 100,
+        results['false_positives']['expected_false_positive_rate'] * 100))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
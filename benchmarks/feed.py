@@ -0,0 +1,53 @@
+"""Synthetic provider feed: NewEvent and UpdateOdds messages shaped like the ones /api/external_providers accepts."""
+import random
+from datetime import datetime, timedelta
+
+SPORT_NAMES = ['Football', 'Golf', 'Tennis', 'Rugby', 'Cricket', 'Basketball', 'Horse Racing', 'Darts',
+               'Snooker', 'Ice Hockey', 'Baseball', 'Boxing']
+
+MARKET_NAMES = ['Winner', 'Place', 'Both Teams To Score', 'Total Goals', 'Handicap', 'First Scorer']
+
+
+class Feed(object):
+
+    def __init__(self, sports=4, markets_per_event=1, selections_per_market=3, first_id=10 ** 9, seed=None):
+        self.random = random.Random(seed)
+        self.sports = [{'id': first_id + i, 'name': SPORT_NAMES[i % len(SPORT_NAMES)] +
+                        ('' if i < len(SPORT_NAMES) else ' %d' % i)} for i in range(sports)]
+        self.markets_per_event = markets_per_event
+        self.selections_per_market = selections_per_market
+        self.next_id = first_id + sports
+        self.start_time = datetime(2021, 1, 1)
+        self.events = []
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def new_event(self):
+        event_id = self.new_id()
+        markets = []
+        for m in range(self.markets_per_event):
+            selections = [{'id': self.new_id(), 'name': 'Selection %d' % s,
+                           'odds': round(self.random.uniform(1.01, 50.0), 2)}
+                          for s in range(self.selections_per_market)]
+            markets.append({'id': self.new_id(), 'name': MARKET_NAMES[m % len(MARKET_NAMES)],
+                            'selections': selections})
+        event = {'id': event_id, 'name': 'Event %d' % event_id,
+                 'startTime': (self.start_time + timedelta(minutes=len(self.events))).strftime('%Y-%m-%d %H:%M:%S'),
+                 'sport': self.random.choice(self.sports), 'markets': markets}
+        self.events.append(event)
+        return {'id': self.new_id(), 'message_type': 'NewEvent', 'event': event}
+
+    def update_odds(self, event=None):
+        event = event or self.random.choice(self.events)
+        markets = [dict(market, selections=[dict(selection, odds=round(self.random.uniform(1.01, 50.0), 2))
+                                            for selection in market['selections']])
+                   for market in event['markets']]
+        return {'id': self.new_id(), 'message_type': 'UpdateOdds', 'event': dict(event, markets=markets)}
+
+    def random_event(self):
+        return self.random.choice(self.events)
+
+    def random_sport(self):
+        return self.random.choice(self.sports)
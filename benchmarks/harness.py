@@ -0,0 +1,207 @@
+"""Throughput and latency of get_match, get_matches and parse_message under a synthetic feed.
+
+By default requests go through the Flask test client against a throwaway database; pass --url to
+drive a running server instead. Results are written as JSON so runs can be compared across commits.
+
+Run from the repository root:
+
+    python -m benchmarks.harness --events 500 --requests 2000 --output base.json
+    python -m benchmarks.harness --url http://127.0.0.1:5000 --concurrency 8 --output head.json
+    python -m benchmarks.harness --compare base.json head.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.feed import Feed
+
+
+class TestClientDriver(object):
+
+    def __init__(self, database_url=None):
+        directory = tempfile.mkdtemp()
+        import app
+        # passed to create_app rather than through the environment, an exported DATABASE_URL must not be written to
+        self.app = app.create_app({
+            'DATABASE_URL': database_url or 'sqlite:///%s' % os.path.join(directory, 'bench.sqlite3'),
+            'LOG_FILE': os.path.join(directory, 'api.log')})
+        self.local = threading.local()
+
+    def client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        return self.local.client
+
+    def get(self, path):
+        response = self.client().get(path)
+        return response.status_code, response.get_data()
+
+    def send(self, method, path, body):
+        response = getattr(self.client(), method)(path, data=body, content_type='application/json')
+        return response.status_code, response.get_data()
+
+
+class HttpDriver(object):
+
+    def __init__(self, url):
+        import requests
+        self.url = url.rstrip('/')
+        self.requests = requests
+        self.local = threading.local()
+
+    def client(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = self.requests.Session()
+        return self.local.session
+
+    def get(self, path):
+        response = self.client().get(self.url + path)
+        return response.status_code, response.content
+
+    def send(self, method, path, body):
+        response = getattr(self.client(), method)(self.url + path, data=body,
+                                                  headers={'Content-type': 'application/json'})
+        return response.status_code, response.content
+
+
+def percentile(latencies, fraction):
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000
+
+
+def run_scenario(name, calls, concurrency):
+    # every call returns True when the response is the one the scenario expects
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def timed(call):
+        started = time.perf_counter()
+        try:
+            ok = call()
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            errors[0] += not ok
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(timed, calls))
+    else:
+        for call in calls:
+            timed(call)
+    seconds = time.perf_counter() - started
+
+    latencies.sort()
+    result = {'requests': len(latencies), 'errors': errors[0], 'seconds': seconds,
+              'throughput': len(latencies) / seconds if seconds else 0.0,
+              'mean_ms': sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+              'p50_ms': percentile(latencies, 0.50) if latencies else 0.0,
+              'p95_ms': percentile(latencies, 0.95) if latencies else 0.0,
+              'p99_ms': percentile(latencies, 0.99) if latencies else 0.0}
+    print('%-12s %8d req %6d err %10.1f req/s  p50 %8.3f  p95 %8.3f  p99 %8.3f ms' % (
+        name, result['requests'], result['errors'], result['throughput'],
+        result['p50_ms'], result['p95_ms'], result['p99_ms']))
+    return result
+
+
+def scenarios(driver, feed, args):
+    new_events = [json.dumps(feed.new_event()) for _ in range(args.events)]
+    yield 'new_event', [lambda body=body: driver.send('post', '/api/external_providers', body) == (200, b'OK')
+                        for body in new_events]
+
+    updates = [json.dumps(feed.update_odds()) for _ in range(args.requests)]
+    yield 'update_odds', [lambda body=body: driver.send('put', '/api/external_providers', body)[0] < 400
+                          for body in updates]
+
+    event_ids = [feed.random_event()['id'] for _ in range(args.requests)]
+    yield 'get_match', [lambda event_id=event_id: driver.get('/api/match/%d' % event_id)[1].startswith(b'{')
+                        for event_id in event_ids]
+
+    listings = []
+    for i in range(args.requests):
+        kind = i % 3
+        if kind == 0:
+            listings.append('/api/match/?sport=%s&limit=%d' % (feed.random_sport()['name'], args.page_size))
+        elif kind == 1:
+            listings.append('/api/match/?name=%s' % feed.random_event()['name'])
+        else:
+            listings.append('/api/match/?ordering=startTime&limit=%d' % args.page_size)
+    yield 'get_matches', [lambda path=path: driver.get(path)[1].startswith(b'[') for path in listings]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    driver = HttpDriver(args.url) if args.url else TestClientDriver(args.database_url)
+    feed = Feed(sports=args.sports, markets_per_event=args.markets, selections_per_market=args.selections,
+                first_id=args.first_id, seed=args.seed)
+
+    report = {'meta': {'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'python': platform.python_version(), 'driver': 'http' if args.url else 'test_client',
+                       'args': {key: value for key, value in vars(args).items() if key != 'compare'}},
+              'scenarios': {}}
+    for name, calls in scenarios(driver, feed, args):
+        report['scenarios'][name] = run_scenario(name, calls, args.concurrency)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def compare(base_path, head_path):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+
+    print('%-12s %22s %22s %22s' % ('', 'throughput req/s', 'p95 ms', 'p99 ms'))
+    for name, result in head['scenarios'].items():
+        before = base['scenarios'].get(name)
+        if before is None:
+            continue
+        cells = []
+        for key in ('throughput', 'p95_ms', 'p99_ms'):
+            change = (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            cells.append('%9.1f -> %-9.1f%+5.0f%%' % (before[key], result[key], change))
+        print('%-12s %s' % (name, ' '.join(cells)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='drive a running server instead of the Flask test client')
+    parser.add_argument('--database-url', help='database for the test client, defaults to a temporary SQLite file')
+    parser.add_argument('--sports', type=int, default=4)
+    parser.add_argument('--markets', type=int, default=1, help='markets per event')
+    parser.add_argument('--selections', type=int, default=10, help='selections per market')
+    parser.add_argument('--events', type=int, default=500, help='NewEvent messages to send')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per read and update scenario')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--first-id', type=int, default=10 ** 9)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'), help='compare two JSON reports and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
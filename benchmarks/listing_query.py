@@ -0,0 +1,97 @@
+"""Per-request overhead of the GET /api/match/ listing query, inlined SQL text vs the bound, cached statement.
+
+Run from the repository root:
+
+    python -m benchmarks.listing_query --events 2000 --requests 5000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+from models import *
+from queries import matches_query
+
+SPORTS = ['Football', 'Golf', 'Tennis', 'Rugby']
+
+
+def legacy_matches_sql(sport=None, name=None, ordering=None):
+    sql = 'select event.id, event.url, event.name, event.startTime from event'
+    if sport:
+        sql += ''' join market on market.id = event.market_id
+                  join sport on sport.id = market.sportId
+                                and lower(sport.name) =  '{sport_name}' '''.format(sport_name=sport.lower())
+    if name:
+        sql += " where event.name = '{event_name}'".format(event_name=name)
+    if ordering:
+        sql += ' order by {ordering}'.format(ordering=ordering)
+        if ordering.lower() == 'starttime':
+            sql += ' desc'
+    return sql
+
+
+def populate(engine, events):
+    Base.metadata.create_all(engine)
+    create_indexes(engine)
+    start = datetime(2021, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(Sport.__table__.insert(), [{'Id': i, 'Name': name} for i, name in enumerate(SPORTS)])
+        connection.execute(Market.__table__.insert(),
+                           [{'Id': i, 'Name': 'Winner', 'SportId': i % len(SPORTS)} for i in range(events)])
+        connection.execute(Event.__table__.insert(),
+                           [{'Id': i, 'URL': 'http://127.0.0.1:5000/api/match/%s' % i, 'Name': 'Event %s' % i,
+                             'StartTime': start + timedelta(minutes=i), 'market_id': i} for i in range(events)])
+
+
+def request_args(events, count):
+    # name lookups keep result sets small, so the timing is dominated by per-request statement overhead
+    return [dict(sport=random.choice(SPORTS) if random.random() < 0.5 else None,
+                 name='Event %s' % random.randrange(events),
+                 ordering=random.choice([None, 'startTime'])) for _ in range(count)]
+
+
+def run_legacy(engine, requests):
+    for kwargs in requests:
+        engine.execute(legacy_matches_sql(**kwargs)).fetchall()
+
+
+def run_bound(engine, requests):
+    for kwargs in requests:
+        statement, params = matches_query(**kwargs)
+        engine.execute(statement, params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    engine = create_engine('sqlite:///%s' % os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'))
+    populate(engine, args.events)
+    requests = request_args(args.events, args.requests)
+
+    results = {}
+    for label, run in (('inlined', run_legacy), ('bound', run_bound)):
+        run(engine, requests[:100])
+        started = time.perf_counter()
+        run(engine, requests)
+        elapsed = time.perf_counter() - started
+        results[label] = {'requests_per_second': args.requests / elapsed,
+                          'us_per_request': elapsed / args.requests * 1e6}
+        print('%-8s %10.1f req/s %10.1f us/req' % (label, results[label]['requests_per_second'],
+                                                   results[label]['us_per_request']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
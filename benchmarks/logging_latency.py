@@ -0,0 +1,115 @@
+"""UpdateOdds request latency with the old synchronous DEBUG file logging vs the queued, summarized setup.
+
+Requests go through the Flask test client against a throwaway database. The old setup is
+logging.basicConfig(filename=..., level=DEBUG) with one INFO line per selection; the new one is
+configure_logging() with the per-market summary.
+
+Run from the repository root:
+
+    python -m benchmarks.logging_latency --selections 100 --requests 2000
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+
+directory = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///%s' % os.path.join(directory, 'bench.sqlite3')
+os.environ['LOG_FILE'] = os.path.join(directory, 'api.log')
+
+import app
+from logging_config import configure_logging
+from models import *
+
+app.create_app()
+
+
+def populate(selections):
+    session = app.session
+    session.add(Sport(id=1, name='Golf'))
+    session.add(Market(id=1, name='Winner', sport_id=1))
+    session.bulk_insert_mappings(Selection, [dict(id=i, name='Runner %s' % i) for i in range(selections)])
+    session.bulk_insert_mappings(Odd, [dict(market_id=1, selection_id=i, odd=1.01) for i in range(selections)])
+    session.commit()
+    session.remove()
+
+
+def update_message(selections):
+    return {'id': 1, 'message_type': 'UpdateOdds',
+            'event': {'id': 1, 'name': 'Open', 'startTime': '2021-01-01 00:00:00',
+                      'sport': {'id': 1, 'name': 'Golf'},
+                      'markets': [{'id': 1, 'name': 'Winner',
+                                   'selections': [{'id': i, 'name': 'Runner %s' % i,
+                                                   'odds': round(random.uniform(1.01, 50.0), 2)}
+                                                  for i in range(selections)]}]}}
+
+
+def reset_logging():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+
+
+def legacy_logging():
+    reset_logging()
+    logging.basicConfig(filename=os.environ['LOG_FILE'], level=logging.DEBUG)
+
+    def log_selections(message):
+        market = message['event']['markets'][0]
+        for i in market['selections']:
+            logging.info('An odd with market with Id: {market_id} and selection with Id: {selection_id} is '
+                         'updated to {odd_value}.'.format(market_id=market['id'], selection_id=i['id'],
+                                                          odd_value=i['odds']))
+    return log_selections
+
+
+def queued_logging():
+    reset_logging()
+    configure_logging(app.app.config)
+
+
+def measure(messages, log_selections=None):
+    client = app.app.test_client()
+    latencies = []
+    for message in messages:
+        started = time.perf_counter()
+        client.put('/api/external_providers', json=message)
+        if log_selections is not None:
+            log_selections(message)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {'p50_ms': latencies[len(latencies) // 2] * 1000,
+            'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000,
+            'mean_ms': statistics.mean(latencies) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--selections', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    populate(args.selections)
+    messages = [update_message(args.selections) for _ in range(args.requests)]
+
+    results = {'old': measure(messages, legacy_logging())}
+    queued_logging()
+    results['new'] = measure(messages)
+
+    for label in ('old', 'new'):
+        print('%-4s p50 %7.3f ms  p95 %7.3f ms  mean %7.3f ms' % (label, results[label]['p50_ms'],
+                                                                 results[label]['p95_ms'], results[label]['mean_ms']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Odds update throughput with one database for every sport vs one SQLite file per sport (SPORT_PARTITIONS).
+
+A threaded server is started on throwaway databases for each layout and seeded with a synthetic feed
+spread over --sports sports. --writers threads then post UpdateOdds messages for random events while
+--readers threads page through GET /api/match/ (which reads every partition), for --seconds. The
+report gives applied updates per second with their latency, failed updates and listing latency.
+
+Run from the repository root:
+
+    python -m benchmarks.partitions --sports 4 --writers 8 --readers 2 --output partitions.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmarks.concurrency import seed
+from benchmarks.feed import Feed
+
+
+def start_server(port, partitioned, sports):
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ, FLASK_APP='app.py', DATABASE_URL='sqlite:///%s' % os.path.join(directory, 'bench.sqlite3'),
+               LOG_FILE=os.path.join(directory, 'api.log'), SPORT_PARTITIONS='')
+    if partitioned:
+        # the first sport stays in the default database
+        env['SPORT_PARTITIONS'] = ';'.join(
+            '%d=sqlite:///%s' % (sport['id'], os.path.join(directory, 'sport%d.sqlite3' % sport['id']))
+            for sport in sports[1:])
+    process = subprocess.Popen([sys.executable, '-m', 'flask', 'run', '--port', str(port), '--with-threads'],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get('http://127.0.0.1:%d/api/cache' % port, timeout=1)
+            return process
+        except requests.ConnectionError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('The server did not start on port %d' % port)
+
+
+def percentile(latencies, fraction):
+    latencies = sorted(latencies)
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000 if latencies else None
+
+
+def write_load(port, feed, deadline, latencies, counts, lock):
+    url = 'http://127.0.0.1:%d/api/external_providers/batch' % port
+    with requests.Session() as session:
+        while time.monotonic() < deadline:
+            message = feed.update_odds()
+            started = time.perf_counter()
+            try:
+                response = session.post(url, data=json.dumps([message]), timeout=30)
+                failed = response.status_code != 200 or response.json()[0].get('result') != 'OK'
+            except (requests.RequestException, ValueError):
+                failed = True
+            elapsed = time.perf_counter() - started
+            with lock:
+                counts['failed' if failed else 'applied'] += 1
+                if not failed:
+                    latencies.append(elapsed)
+
+
+def read_load(port, deadline, latencies, lock):
+    url = 'http://127.0.0.1:%d/api/match/?limit=50' % port
+    with requests.Session() as session:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            session.get(url, timeout=30)
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+
+def run(port, feed, args):
+    deadline = time.monotonic() + args.seconds
+    lock = threading.Lock()
+    write_latencies, read_latencies, counts = [], [], {'applied': 0, 'failed': 0}
+    threads = [threading.Thread(target=write_load, args=(port, feed, deadline, write_latencies, counts, lock))
+               for _ in range(args.writers)] + \
+              [threading.Thread(target=read_load, args=(port, deadline, read_latencies, lock))
+               for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {'writes_per_second': counts['applied'] / args.seconds, 'write_failures': counts['failed'],
+            'write_p50_ms': percentile(write_latencies, 0.5), 'write_p99_ms': percentile(write_latencies, 0.99),
+            'listing_p50_ms': percentile(read_latencies, 0.5), 'listing_p99_ms': percentile(read_latencies, 0.99),
+            'listings': len(read_latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sports', type=int, default=4)
+    parser.add_argument('--events', type=int, default=400)
+    parser.add_argument('--writers', type=int, default=8, help='threads posting odds updates')
+    parser.add_argument('--readers', type=int, default=2, help='threads reading the listing')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--port', type=int, default=5300)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for layout, partitioned in (('single', False), ('partitioned', True)):
+        feed = Feed(sports=args.sports, seed=0)
+        process = start_server(args.port, partitioned, feed.sports)
+        try:
+            seed(args.port, feed, args.events)
+            results[layout] = run(args.port, feed, args)
+        finally:
+            process.terminate()
+            process.wait()
+        result = results[layout]
+        print('%-12s writes %8.1f/s p50 %8.2f p99 %8.2f ms (%d failed)  listing p50 %8.2f p99 %8.2f ms' % (
+            layout, result['writes_per_second'], result['write_p50_ms'] or 0, result['write_p99_ms'] or 0,
+            result['write_failures'], result['listing_p50_ms'] or 0, result['listing_p99_ms'] or 0))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
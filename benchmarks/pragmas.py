@@ -0,0 +1,125 @@
+"""Mixed read/write throughput of the match endpoints' queries under each SQLite pragma preset.
+
+Readers run the GET /api/match/<id> join while writers update a market's odds and commit, all on
+one file database through the app's engine factory.
+
+Run from the repository root:
+
+    python -m benchmarks.pragmas --readers 4 --writers 1 --seconds 5
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from config import Config
+from database import PRAGMA_PRESETS, make_engine
+from models import *
+from queries import match_query
+
+
+def bench_config(preset, path):
+    config = {name: getattr(Config, name) for name in dir(Config) if name.isupper()}
+    config.update(DATABASE_URL='sqlite:///%s' % path, DB_ECHO=False, DB_PRAGMA_PRESET=preset)
+    return config
+
+
+def populate(engine, events, selections):
+    Base.metadata.create_all(engine)
+    create_indexes(engine)
+    with engine.begin() as connection:
+        connection.execute(Sport.__table__.insert(), [{'Id': 1, 'Name': 'Golf'}])
+        connection.execute(Selection.__table__.insert(),
+                           [{'Id': i, 'Name': 'Runner %s' % i} for i in range(selections)])
+        connection.execute(Market.__table__.insert(), [{'Id': i, 'Name': 'Winner', 'SportId': 1} for i in range(events)])
+        connection.execute(Odd.__table__.insert(), [{'MarketId': m, 'SelectionId': i, 'Odd': 1.01}
+                                                    for m in range(events) for i in range(selections)])
+        connection.execute(Event.__table__.insert(),
+                           [{'Id': i, 'URL': 'http://127.0.0.1:5000/api/match/%s' % i, 'Name': 'Event %s' % i,
+                             'StartTime': datetime(2021, 1, 1), 'market_id': i} for i in range(events)])
+        connection.execute(event_market.insert(), [{'EventId': i, 'MarketId': i} for i in range(events)])
+
+
+def reader(Session, events, stop, counts):
+    session = Session()
+    while not stop.is_set():
+        match_query(session, random.randrange(events)).all()
+        session.rollback()
+        counts['reads'] += 1
+    session.close()
+
+
+def writer(Session, events, selections, stop, counts):
+    session = Session()
+    while not stop.is_set():
+        market_id = random.randrange(events)
+        try:
+            session.bulk_update_mappings(Odd, [dict(market_id=market_id, selection_id=i,
+                                                    odd=round(random.uniform(1.01, 50.0), 2))
+                                               for i in range(selections)])
+            session.commit()
+            counts['writes'] += 1
+        except OperationalError:
+            session.rollback()
+            counts['errors'] += 1
+    session.close()
+
+
+def run(preset, args):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    engine = make_engine(bench_config(preset, path))
+    populate(engine, args.events, args.selections)
+    Session = sessionmaker(bind=engine)
+
+    stop = threading.Event()
+    counts = [{'reads': 0, 'writes': 0, 'errors': 0} for _ in range(args.readers + args.writers)]
+    threads = [threading.Thread(target=reader, args=(Session, args.events, stop, counts[i]))
+               for i in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(Session, args.events, args.selections, stop, counts[i]))
+                for i in range(args.readers, args.readers + args.writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    totals = {key: sum(count[key] for count in counts) for key in ('reads', 'writes', 'errors')}
+    return {'preset': preset, 'reads_per_second': totals['reads'] / args.seconds,
+            'writes_per_second': totals['writes'] / args.seconds, 'errors': totals['errors']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--presets', nargs='+', default=sorted(PRAGMA_PRESETS))
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--selections', type=int, default=20)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=1)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    print('%-8s %12s %12s %8s' % ('preset', 'reads/s', 'writes/s', 'errors'))
+    for preset in args.presets:
+        result = run(preset, args)
+        results.append(result)
+        print('%-8s %12.1f %12.1f %8d' % (preset, result['reads_per_second'], result['writes_per_second'],
+                                          result['errors']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Cold start cost: importing app.py, create_app() with and without the schema check, and the first requests.
+
+Every measurement runs in a fresh interpreter against a throwaway database that `flask init-db` created
+and a synthetic feed filled, so nothing is cached between runs. Reported per phase: the median and
+the slowest of --runs runs, in milliseconds.
+
+- import: `import app`, which touches neither the database nor the log file
+- create_app: engines, schema check, logging, odds index warm-up and background services
+- create_app (SCHEMA_CHECK=0): the same without the schema check, for databases set up by init-db
+- first request: GET /api/match/<id> right after the import, so including the lazy set-up
+- second request: the same request once everything is set up
+
+Run from the repository root:
+
+    python -m benchmarks.startup --runs 10 --events 1000 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEED = '''
+import json, sys
+import app
+from benchmarks.feed import Feed
+app.create_app()
+client = app.app.test_client()
+feed = Feed(seed=0)
+for _ in range(int(sys.argv[1])):
+    client.post('/api/external_providers', data=json.dumps(feed.new_event()), content_type='application/json')
+print(feed.events[0]['id'])
+'''
+
+MEASURE = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+timings = {'import': imported - started}
+if sys.argv[1] == 'create_app':
+    app.create_app()
+    timings['create_app'] = time.perf_counter() - imported
+else:
+    client = app.app.test_client()
+    for name in ('first_request', 'second_request'):
+        started = time.perf_counter()
+        client.get('/api/match/%s' % sys.argv[2])
+        timings[name] = time.perf_counter() - started
+print(json.dumps(timings))
+'''
+
+
+def run_child(code, arguments, env):
+    output = subprocess.check_output([sys.executable, '-c', code] + arguments, cwd=ROOT, env=env)
+    return output.decode().strip().splitlines()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ, FLASK_APP='app.py', PYTHONPATH=ROOT,
+               DATABASE_URL='sqlite:///%s' % os.path.join(directory, 'bench.sqlite3'),
+               LOG_FILE=os.path.join(directory, 'api.log'))
+    subprocess.check_call([sys.executable, '-m', 'flask', 'init-db'], cwd=ROOT, env=env)
+    event_id = run_child(SEED, [str(args.events)], env)
+
+    samples = {}
+    phases = (('create_app', 'create_app', env),
+              ('create_app (SCHEMA_CHECK=0)', 'create_app', dict(env, SCHEMA_CHECK='0')),
+              ('requests', 'requests', env))
+    for _ in range(args.runs):
+        for label, mode, phase_env in phases:
+            timings = json.loads(run_child(MEASURE, [mode, event_id], phase_env))
+            for name, seconds in timings.items():
+                if name == 'create_app':
+                    name = label
+                samples.setdefault(name, []).append(seconds * 1000)
+
+    results = {name: {'median_ms': statistics.median(values), 'max_ms': max(values)}
+               for name, values in samples.items()}
+    for name, result in results.items():
+        print('%-30s median %8.2f ms  max %8.2f ms' % (name, result['median_ms'], result['max_ms']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(results, runs=args.runs, events=args.events), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Read and write throughput of serve.py's process topologies on several cores.
+
+For every topology (split: one writer process and read-only workers, copies: workers that all write
+to the database) and worker count, serve.py is started on a throwaway database seeded with a synthetic
+feed. Reader processes then keep --concurrency connections each busy with GETs of matches and listing
+pages while --writers threads post odds updates, for --seconds. The report gives read throughput and
+latency, applied odds updates per second and failed writes ("database is locked" and the like).
+
+Run from the repository root:
+
+    python -m benchmarks.topology --workers 1 2 4 8 --readers 4 --output topology.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+
+from benchmarks.concurrency import run_level, seed
+from benchmarks.feed import Feed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_serve(topology, workers, port):
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL='sqlite:///%s' % os.path.join(directory, 'bench.sqlite3'),
+               LOG_FILE=os.path.join(directory, 'api.log'), WRITER_ADDRESS=os.path.join(directory, 'writer.sock'))
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'serve.py'), '--topology', topology,
+                                '--workers', str(workers), '--port', str(port)],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get('http://127.0.0.1:%d/api/cache' % port, timeout=1)
+            return process
+        except requests.RequestException:
+            # refused until the socket is bound, and slow while a worker runs create_app on its first request
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('serve.py --topology %s did not start on port %d' % (topology, port))
+
+
+def read_load(port, paths, concurrency, seconds, timeout):
+    return asyncio.run(run_level(port, paths, concurrency, seconds, timeout))
+
+
+def write_load(port, feed, deadline, counts, lock):
+    url = 'http://127.0.0.1:%d/api/external_providers/batch' % port
+    with requests.Session() as session:
+        while time.monotonic() < deadline:
+            message = feed.update_odds()
+            try:
+                response = session.post(url, data=json.dumps([message]), timeout=30)
+                failed = response.status_code != 200 or response.json()[0].get('result') != 'OK'
+            except (requests.RequestException, ValueError):
+                failed = True
+            with lock:
+                counts['failed' if failed else 'applied'] += 1
+
+
+def run(port, feed, paths, args):
+    deadline = time.monotonic() + args.seconds
+    counts, lock = {'applied': 0, 'failed': 0}, threading.Lock()
+    writers = [threading.Thread(target=write_load, args=(port, feed, deadline, counts, lock))
+               for _ in range(args.writers)]
+    for thread in writers:
+        thread.start()
+    with ProcessPoolExecutor(args.readers) as pool:
+        reads = list(pool.map(read_load, *zip(*[(port, paths, args.concurrency, args.seconds, args.timeout)
+                                                  for _ in range(args.readers)])))
+    for thread in writers:
+        thread.join()
+
+    ok = sum(result['ok'] for result in reads)
+    return {'reads_per_second': ok / args.seconds,
+            'read_errors': sum(result['errors'] + result['timeouts'] for result in reads),
+            # percentiles of the slowest reader process
+            'read_p50_ms': max(result['p50_ms'] or 0 for result in reads),
+            'read_p99_ms': max(result['p99_ms'] or 0 for result in reads),
+            'writes_per_second': counts['applied'] / args.seconds,
+            'write_failures': counts['failed']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--topologies', nargs='+', default=['copies', 'split'], choices=['copies', 'split'])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--readers', type=int, default=2, help='client processes issuing GETs')
+    parser.add_argument('--concurrency', type=int, default=16, help='connections per reader process')
+    parser.add_argument('--writers', type=int, default=4, help='client threads posting odds updates')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--port', type=int, default=5200)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for topology in args.topologies:
+        for workers in args.workers:
+            process = start_serve(topology, workers, args.port)
+            try:
+                feed = Feed(seed=0)
+                seed(args.port, feed, args.events)
+                paths = ['/api/match/%d' % event['id'] for event in feed.events] + \
+                        ['/api/match/?sport=%s&limit=20' % sport['name'] for sport in feed.sports]
+                result = dict(run(args.port, feed, paths, args), topology=topology, workers=workers,
+                              cpus=os.cpu_count())
+            finally:
+                process.terminate()
+                process.wait()
+            results.append(result)
+            print('%-6s %3d workers  reads %9.1f/s p50 %8.2f p99 %8.2f ms (%d errors)  writes %8.1f/s (%d failed)' % (
+                topology, workers, result['reads_per_second'], result['read_p50_ms'], result['read_p99_ms'],
+                result['read_errors'], result['writes_per_second'], result['write_failures']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""UpdateOdds throughput against market size, per-selection updates vs the bulk path.
+
+Run from the repository root:
+
+    python -m benchmarks.update_odds --sizes 2 10 100 500 --rounds 200
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, and_
+
+import app
+from models import *
+
+
+def legacy_update_odds(message):
+    session = app.session
+    market = message.get('event').get('markets')[0]
+    market_id = session.query(Market).filter(Market.id == market.get('id')).scalar()
+    if market and market_id:
+        market_id = market.get('id')
+        for i in market.get('selections'):
+            selection_id = i.get('id')
+            odd_value = i.get('odds')
+            session.query(Odd). \
+                filter(and_(Odd.selection_id == selection_id, Odd.market_id == market_id)). \
+                update({"odd": odd_value})
+            app.logging.info('An odd with market with Id: {market_id} and selection with Id: {selection_id} is '
+                             'updated to {odd_value}.'.format(market_id=market_id, selection_id=selection_id,
+                                                              odd_value=odd_value))
+        session.commit()
+
+
+def populate(session, size):
+    session.add(Sport(id=1, name='Golf'))
+    session.add(Market(id=1, name='Winner', sport_id=1))
+    session.bulk_insert_mappings(Selection, [dict(id=i, name='Runner %s' % i) for i in range(1, size + 1)])
+    session.bulk_insert_mappings(Odd, [dict(market_id=1, selection_id=i, odd=1.01) for i in range(1, size + 1)])
+    session.commit()
+
+
+def update_message(size):
+    selections = [{'id': i, 'name': 'Runner %s' % i, 'odds': round(random.uniform(1.01, 50.0), 2)}
+                  for i in range(1, size + 1)]
+    return {'id': 1, 'message_type': 'UpdateOdds',
+            'event': {'id': 1, 'name': 'Open', 'startTime': '2021-01-01 00:00:00',
+                      'sport': {'id': 1, 'name': 'Golf'},
+                      'markets': [{'id': 1, 'name': 'Winner', 'selections': selections}]}}
+
+
+def run(update, size, rounds):
+    directory = tempfile.mkdtemp()
+    engine = create_engine('sqlite:///%s' % os.path.join(directory, 'bench.sqlite3'))
+    Base.metadata.create_all(engine)
+    app.session.remove()
+    app.session.configure(bind=engine)
+    populate(app.session, size)
+    messages = [update_message(size) for _ in range(rounds)]
+
+    started = time.perf_counter()
+    for message in messages:
+        update(message)
+    elapsed = time.perf_counter() - started
+
+    app.session.remove()
+    engine.dispose()
+    return rounds / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2, 10, 50, 100, 500])
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    # every run binds the session to its own database, this one only holds the schema create_app checks
+    directory = tempfile.mkdtemp()
+    app.create_app({
+        'DATABASE_URL': 'sqlite:///%s' % os.path.join(directory, 'app.sqlite3'),
+        'LOG_FILE': os.path.join(directory, 'api.log')})
+
+    results = []
+    print('%10s %16s %16s %8s' % ('selections', 'before msg/s', 'after msg/s', 'speedup'))
+    for size in args.sizes:
+        before = run(legacy_update_odds, size, args.rounds)
+        after = run(app.update_odds, size, args.rounds)
+        results.append({'selections': size, 'before': before, 'after': after})
+        print('%10d %16.1f %16.1f %7.1fx' % (size, before, after, after / before))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
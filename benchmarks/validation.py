@@ -0,0 +1,78 @@
+"""Message validation cost over large synthetic markets, chained isinstance checks vs the compiled validator.
+
+Run from the repository root:
+
+    python -m benchmarks.validation --selections 10 100 1000 --rounds 2000
+"""
+import argparse
+import json
+import time
+
+from validation import message_error
+
+
+def validate_date_type(message):
+    validation = isinstance(message.get('id'), int) \
+                 & isinstance(message.get('message_type'), str)\
+                 & isinstance(message.get('event').get('id'), int) \
+                 & isinstance(message.get('event').get('name'), str) \
+                 & isinstance(message.get('event').get('startTime'), str) \
+                 & isinstance(message.get('event').get('sport').get('id'), int) \
+                 & isinstance(message.get('event').get('sport').get('name'), str)
+
+    markets = message.get('event').get('markets')
+    if markets and validation:
+        market = markets[0]
+        validation = validation & isinstance(market.get('id'), int) \
+                     & isinstance(market.get('name'), str)
+
+        selections = market.get('selections')
+        for i in selections:
+            validation = validation & isinstance(i.get('id'), int) \
+                         & isinstance(i.get('name'), str) \
+                         & isinstance(i.get('odds'), float)
+    else:
+        validation = False
+    return validation
+
+
+def message(selections, broken_at=None):
+    items = [{'id': i, 'name': 'Runner %s' % i, 'odds': 1.5} for i in range(selections)]
+    if broken_at is not None:
+        items[broken_at]['odds'] = 'not available'
+    return {'id': 1, 'message_type': 'UpdateOdds',
+            'event': {'id': 1, 'name': 'Open', 'startTime': '2021-01-01 00:00:00',
+                      'sport': {'id': 1, 'name': 'Golf'},
+                      'markets': [{'id': 1, 'name': 'Winner', 'selections': items}]}}
+
+
+def timed(validate, payload, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        validate(payload)
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--selections', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    print('%10s %-14s %12s %12s' % ('selections', 'payload', 'old us', 'compiled us'))
+    for size in args.selections:
+        for label, payload in (('valid', message(size)), ('first invalid', message(size, broken_at=0))):
+            old = timed(validate_date_type, payload, args.rounds)
+            new = timed(message_error, payload, args.rounds)
+            results.append({'selections': size, 'payload': label, 'old_us': old, 'compiled_us': new})
+            print('%10d %-14s %12.2f %12.2f' % (size, label, old, new))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
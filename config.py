@@ -0,0 +1,54 @@
+import os
+
+
+class Config(object):
+    DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///db.sqlite3')
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+    ROLE = os.environ.get('ROLE', 'all')
+    DB_READ_ONLY = os.environ.get('DB_READ_ONLY', '1' if ROLE == 'reader' else '0') == '1'
+    SPORT_PARTITIONS = os.environ.get('SPORT_PARTITIONS', '')
+    SCHEMA_CHECK = os.environ.get('SCHEMA_CHECK', '1') == '1'
+    DB_ECHO = os.environ.get('DB_ECHO', '0') == '1'
+    DB_PRAGMA_PRESET = os.environ.get('DB_PRAGMA_PRESET', 'wal')
+    DB_JOURNAL_MODE = os.environ.get('DB_JOURNAL_MODE')
+    DB_SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS')
+    DB_CACHE_SIZE = os.environ.get('DB_CACHE_SIZE')
+    DB_MMAP_SIZE = os.environ.get('DB_MMAP_SIZE')
+    DB_TEMP_STORE = os.environ.get('DB_TEMP_STORE')
+    DB_BUSY_TIMEOUT = os.environ.get('DB_BUSY_TIMEOUT')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 3600))
+    MATCH_CACHE_SIZE = int(os.environ.get('MATCH_CACHE_SIZE', 1024))
+    MATCH_CACHE_TTL = float(os.environ.get('MATCH_CACHE_TTL', 5))
+    MATCH_SNAPSHOTS = os.environ.get('MATCH_SNAPSHOTS', '0') == '1'
+    GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', 1024))
+    GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 5))
+    MATCHES_PAGE_SIZE = int(os.environ.get('MATCHES_PAGE_SIZE', 100))
+    MATCHES_MAX_PAGE_SIZE = int(os.environ.get('MATCHES_MAX_PAGE_SIZE', 1000))
+    ODDS_INDEX = os.environ.get('ODDS_INDEX', '1') == '1'
+    ODDS_COALESCE = os.environ.get('ODDS_COALESCE', '0') == '1'
+    STREAM_BUFFER_SIZE = int(os.environ.get('STREAM_BUFFER_SIZE', 100))
+    STREAM_KEEPALIVE = float(os.environ.get('STREAM_KEEPALIVE', 15))
+    DUPLICATE_FILTER = os.environ.get('DUPLICATE_FILTER', '1') == '1'
+    DUPLICATE_FILTER_CAPACITY = int(os.environ.get('DUPLICATE_FILTER_CAPACITY', 1000000))
+    DUPLICATE_FILTER_ERROR_RATE = float(os.environ.get('DUPLICATE_FILTER_ERROR_RATE', 0.001))
+    DUPLICATE_RECENT_SIZE = int(os.environ.get('DUPLICATE_RECENT_SIZE', 100000))
+    INGEST_ASYNC = os.environ.get('INGEST_ASYNC', '0') == '1'
+    INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 10000))
+    INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 500))
+    INGEST_LINGER_MS = float(os.environ.get('INGEST_LINGER_MS', 5))
+    WRITER_ADDRESS = os.environ.get('WRITER_ADDRESS', 'writer.sock')
+    WRITER_AUTHKEY = os.environ.get('WRITER_AUTHKEY', '').encode() or None
+    WRITER_TIMEOUT = float(os.environ.get('WRITER_TIMEOUT', 30))
+    METRICS = os.environ.get('METRICS', '1') == '1'
+    TEST_RESET = os.environ.get('TEST_RESET', '0') == '1'
+    SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 0))
+    LOG_FILE = os.environ.get('LOG_FILE', 'api.log')
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = os.environ.get('LOG_LEVELS', 'sqlalchemy.engine=WARNING')
+    LOG_QUEUE = os.environ.get('LOG_QUEUE', '1') == '1'
+    ODDS_HISTORY = os.environ.get('ODDS_HISTORY', '1') == '1'
+    ODDS_LOG_INTERVAL = float(os.environ.get('ODDS_LOG_INTERVAL', 10))
+    ODDS_LOG_SAMPLE_RATE = float(os.environ.get('ODDS_LOG_SAMPLE_RATE', 0.01))
@@ -0,0 +1,82 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool, StaticPool
+
+PRAGMAS = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'busy_timeout')
+
+PRAGMA_PRESETS = {
+    # SQLite's own defaults: rollback journal, synchronous=FULL, small page cache
+    'default': {},
+    # readers and the writer no longer block each other; NORMAL is durable in WAL mode except on power loss
+    'wal': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -65536, 'mmap_size': 268435456,
+            'temp_store': 'MEMORY', 'busy_timeout': 5000},
+    # no fsync at all, for benchmarks and throwaway databases
+    'fast': {'journal_mode': 'WAL', 'synchronous': 'OFF', 'cache_size': -262144, 'mmap_size': 1073741824,
+             'temp_store': 'MEMORY', 'busy_timeout': 5000},
+}
+
+
+def sqlite_pragmas(config):
+    pragmas = dict(PRAGMA_PRESETS[config['DB_PRAGMA_PRESET']])
+    for name in PRAGMAS:
+        value = config.get('DB_' + name.upper())
+        if value is not None:
+            pragmas[name] = value
+    return pragmas
+
+
+def set_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+    return on_connect
+
+
+def make_engine(config):
+    url = make_url(config['DATABASE_URL'])
+    options = dict(echo=config['DB_ECHO'],
+                   poolclass=QueuePool,
+                   pool_size=config['DB_POOL_SIZE'],
+                   max_overflow=config['DB_MAX_OVERFLOW'],
+                   pool_timeout=config['DB_POOL_TIMEOUT'],
+                   pool_recycle=config['DB_POOL_RECYCLE'])
+
+    if url.get_backend_name() != 'sqlite':
+        return create_engine(url, **options)
+
+    pragmas = sqlite_pragmas(config)
+    if config.get('DB_READ_ONLY') and url.database not in (None, '', ':memory:'):
+        # the journal mode can not be changed on a read-only connection, it is whatever the writer set
+        url = url.set(database='file:%s' % url.database, query=dict(url.query, mode='ro', uri='true'))
+        pragmas.pop('journal_mode', None)
+
+    # pooled connections are handed to whichever request thread checks them out
+    options['connect_args'] = {'check_same_thread': False}
+    if url.database in (None, '', ':memory:'):
+        # every connection to an in-memory database is a new, empty database
+        options = dict(echo=config['DB_ECHO'], poolclass=StaticPool, connect_args=options['connect_args'])
+
+    engine = create_engine(url, **options)
+    event.listen(engine, 'connect', set_pragmas(pragmas))
+    return engine
+
+
+def async_database_url(config):
+    if config.get('ASYNC_DATABASE_URL'):
+        return config['ASYNC_DATABASE_URL']
+    url = make_url(config['DATABASE_URL'])
+    if url.get_backend_name() == 'sqlite' and url.get_driver_name() == 'pysqlite':
+        url = url.set(drivername='sqlite+aiosqlite')
+    return str(url)
+
+
+def make_async_engine(config):
+    # SQLAlchemy's asyncio extension and the aiosqlite driver are only needed by asgi_app.py
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(async_database_url(config), echo=config['DB_ECHO'])
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine.sync_engine, 'connect', set_pragmas(sqlite_pragmas(config)))
+    return engine
@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from hashlib import blake2b
+import math
+import sys
+import threading
+
+
+class BloomFilter(object):
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # bit and hash counts that keep the error rate once capacity ids are in
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        # two halves of one digest, combined into as many positions as needed (double hashing)
+        digest = blake2b(key, digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+    def expected_error_rate(self):
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class DuplicateFilter(object):
+
+    def __init__(self, capacity=1000000, error_rate=0.001, recent_size=100000):
+        # every id ever committed, possibly; a miss means the id is new without asking the database
+        self.bloom = BloomFilter(capacity, error_rate)
+        # ids committed recently, for certain; providers resend within seconds, so these are the duplicates
+        self.recent = OrderedDict()
+        self.recent_size = recent_size
+        self.lock = threading.Lock()
+        self.rejected = 0
+        self.skipped = 0
+        self.possible = 0
+        self.false_positives = 0
+
+    @staticmethod
+    def key(kind, id):
+        return ('%s:%s' % (kind, id)).encode()
+
+    def add(self, kind, ids, recent=True):
+        with self.lock:
+            for id in ids:
+                key = self.key(kind, id)
+                if key not in self.bloom:
+                    self.bloom.add(key)
+                if recent and self.recent_size:
+                    self.recent[key] = None
+                    self.recent.move_to_end(key)
+            while len(self.recent) > self.recent_size:
+                self.recent.popitem(last=False)
+
+    def classify(self, kind, ids):
+        seen, possible = set(), set()
+        with self.lock:
+            for id in ids:
+                key = self.key(kind, id)
+                if key in self.recent:
+                    seen.add(id)
+                elif key in self.bloom:
+                    possible.add(id)
+            self.rejected += len(seen)
+            self.skipped += len(ids) - len(seen) - len(possible)
+            self.possible += len(possible)
+        return seen, possible
+
+    def confirmed(self, possible, found):
+        # possible hits the database did not know are the filter's false positives
+        with self.lock:
+            self.false_positives += len(possible) - len(found)
+
+    def clear_recent(self):
+        with self.lock:
+            self.recent.clear()
+
+    def memory(self):
+        # the bit array, the recent ids' table and their keys
+        return sys.getsizeof(self.bloom.bits) + sys.getsizeof(self.recent) + \
+            sum(sys.getsizeof(key) for key in self.recent)
+
+    def stats(self):
+        with self.lock:
+            return {'ids': self.bloom.count, 'capacity': self.bloom.capacity, 'recent': len(self.recent),
+                    'recent_size': self.recent_size, 'bits': self.bloom.size, 'hashes': self.bloom.hashes,
+                    'memory_bytes': self.memory(), 'expected_false_positive_rate': self.bloom.expected_error_rate(),
+                    'false_positive_rate': self.false_positives / self.possible if self.possible else 0.0,
+                    'rejected_from_memory': self.rejected, 'lookups_skipped': self.skipped,
+                    'possible_hits': self.possible, 'false_positives': self.false_positives}
@@ -0,0 +1,64 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def format_datetime(value):
+    # same text as strftime('%Y-%m-%d %H:%M:%S') without going through the format parser
+    return value.isoformat(' ', 'seconds')
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj)
+
+
+def orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj).decode()
+    except TypeError:
+        # orjson refuses integers wider than 64 bits
+        return json.dumps(obj)
+
+
+dumps = orjson_dumps if orjson is not None else stdlib_dumps
+
+
+def encode_match(rows):
+    first = rows[0]
+    markets = {}
+    for row in rows:
+        market = markets.get(row[6])
+        if market is None:
+            market = markets[row[6]] = {'id': row[6], 'name': row[7], 'selections': []}
+        market['selections'].append({'id': row[8], 'name': row[9], 'odds': row[10]})
+    return dumps({'id': first[0], 'url': first[1], 'name': first[2], 'startTime': format_datetime(first[3]),
+                  'sport': {'id': first[4], 'name': first[5]},
+                  'markets': list(markets.values())})
+
+
+def match_summary(row):
+    return {'id': row[0], 'url': row[1], 'name': row[2], 'startTime': format_datetime(row[3])}
+
+
+def encode_matches(rows):
+    return dumps([match_summary(row) for row in rows])
+
+
+def encode_match_line(row):
+    return dumps(match_summary(row)) + '\n'
+
+
+def encode_matches_ndjson(rows):
+    return ''.join(encode_match_line(row) for row in rows)
+
+
+def encode_odds_history(rows):
+    return dumps([{'time': row[0].isoformat(' ', 'milliseconds'), 'odds': row[1]} for row in rows])
+
+
+def encode_odds_delta(event_id, markets):
+    return dumps({'id': event_id, 'markets': [{'id': market_id, 'selections': selections}
+                                              for market_id, selections in markets.items()]})
@@ -0,0 +1,96 @@
+import logging
+import queue
+import threading
+import time
+
+STOP = object()
+
+log = logging.getLogger('ingest.queue')
+
+
+class IngestQueue(object):
+
+    def __init__(self, apply_batch, maxsize=10000, batch_size=500, linger=0.005):
+        self.apply_batch = apply_batch
+        self.queue = queue.Queue(maxsize)
+        self.batch_size = batch_size
+        self.linger = linger
+        self.thread = None
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.last_commit_latency = 0.0
+        self.max_commit_latency = 0.0
+        self.total_commit_latency = 0.0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='ingest-writer', daemon=True)
+            self.thread.start()
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+        with self.lock:
+            self.accepted += 1
+        return True
+
+    def stop(self, timeout=None):
+        if self.thread is not None:
+            self.queue.put(STOP)
+            self.thread.join(timeout)
+            self.thread = None
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        if batch[0] is STOP:
+            return [], True
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            try:
+                message = self.queue.get(timeout=max(deadline - time.monotonic(), 0)) \
+                    if self.linger else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if message is STOP:
+                return batch, True
+            batch.append(message)
+        return batch, False
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self.next_batch()
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                self.apply_batch(batch)
+                failed = False
+            except Exception as e:
+                log.warning('Failed to write a batch of %d queued messages: %s' % (len(batch), e))
+                failed = True
+            latency = time.perf_counter() - started
+            with self.lock:
+                self.batches += 1
+                self.failed_batches += failed
+                self.processed += 0 if failed else len(batch)
+                self.last_commit_latency = latency
+                self.max_commit_latency = max(self.max_commit_latency, latency)
+                self.total_commit_latency += latency
+
+    def stats(self):
+        with self.lock:
+            return {'depth': self.queue.qsize(), 'maxsize': self.queue.maxsize, 'running': self.thread is not None,
+                    'accepted': self.accepted, 'rejected': self.rejected, 'processed': self.processed,
+                    'batches': self.batches, 'failed_batches': self.failed_batches,
+                    'last_commit_latency_ms': self.last_commit_latency * 1000,
+                    'max_commit_latency_ms': self.max_commit_latency * 1000,
+                    'avg_commit_latency_ms': self.total_commit_latency / self.batches * 1000 if self.batches else 0.0}
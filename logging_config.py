@@ -0,0 +1,73 @@
+import atexit
+import logging
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s %(levelname)s:%(name)s:%(message)s'
+
+
+def parse_levels(levels):
+    for item in levels.split(','):
+        if item.strip():
+            name, level = item.split('=')
+            yield name.strip(), level.strip().upper()
+
+
+def configure_logging(config):
+    handler = logging.FileHandler(config['LOG_FILE'], delay=True)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root = logging.getLogger()
+    root.setLevel(config['LOG_LEVEL'].upper())
+    for name, level in parse_levels(config['LOG_LEVELS']):
+        logging.getLogger(name).setLevel(level)
+
+    if not config['LOG_QUEUE']:
+        root.addHandler(handler)
+        return None
+
+    # request threads only enqueue records, the listener thread formats and writes them
+    log_queue = queue.Queue(-1)
+    root.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class OddsLogSummary(object):
+
+    def __init__(self, logger, interval=10.0, sample_rate=0.0):
+        self.logger = logger
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.updates = 0
+        self.markets = set()
+        self.matched = 0
+        self.unmatched = 0
+
+    def record(self, market_id, matched, unmatched):
+        if self.sample_rate and self.logger.isEnabledFor(logging.DEBUG) and random.random() < self.sample_rate:
+            self.logger.debug('Odds of market with Id: %s are updated for %d selections, %d selections not found.',
+                              market_id, matched, unmatched)
+
+        with self.lock:
+            self.updates += 1
+            self.markets.add(market_id)
+            self.matched += matched
+            self.unmatched += unmatched
+            now = time.monotonic()
+            if now - self.started < self.interval:
+                return
+            summary = (self.updates, len(self.markets), self.matched, self.unmatched, now - self.started)
+            self.started = now
+            self.updates = self.matched = self.unmatched = 0
+            self.markets = set()
+
+        self.logger.info('%d odds updates on %d markets in the last %.1fs: %d selections updated, %d not found.',
+                         summary[0], summary[1], summary[4], summary[2], summary[3])
@@ -0,0 +1,130 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+HISTOGRAMS = (
+    ('http_request_duration_seconds', 'Time spent handling the request.', LATENCY_BUCKETS),
+    ('http_request_db_seconds', 'Time spent executing SQL statements.', LATENCY_BUCKETS),
+    ('http_request_db_statements', 'SQL statements executed.', STATEMENT_BUCKETS),
+    ('http_request_serialization_seconds', 'Time spent encoding the response body.', LATENCY_BUCKETS),
+)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+def format_value(value):
+    return value if isinstance(value, str) else repr(float(value))
+
+
+def format_labels(labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in labels)
+
+
+class RequestMetrics(object):
+
+    def __init__(self, slow_request_ms=0, slow_log=None):
+        self.slow_request = slow_request_ms / 1000
+        self.slow_log = slow_log
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def instrument(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self.local, 'request', None) is not None:
+            conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        current = getattr(self.local, 'request', None)
+        started = conn.info.get('metrics_started')
+        if current is None or not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        current['statements'] += 1
+        current['db'] += elapsed
+        if self.slow_request:
+            current['sql'].append((elapsed, statement))
+
+    def start(self):
+        self.local.request = {'started': time.perf_counter(), 'statements': 0, 'db': 0.0,
+                              'serialization': 0.0, 'sql': []}
+
+    @contextmanager
+    def serializing(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            current = getattr(self.local, 'request', None)
+            if current is not None:
+                current['serialization'] += time.perf_counter() - started
+
+    def finish(self, method, route):
+        current = getattr(self.local, 'request', None)
+        if current is None:
+            return
+        self.local.request = None
+        duration = time.perf_counter() - current['started']
+        labels = (('method', method), ('route', route))
+        with self.lock:
+            self.observe('http_request_duration_seconds', labels, duration)
+            self.observe('http_request_db_seconds', labels, current['db'])
+            self.observe('http_request_db_statements', labels, current['statements'])
+            self.observe('http_request_serialization_seconds', labels, current['serialization'])
+
+        if self.slow_request and self.slow_log is not None and duration >= self.slow_request:
+            self.slow_log.warning('%s %s took %.1f ms, %d statements, %.1f ms in the database:\n%s' % (
+                method, route, duration * 1000, current['statements'], current['db'] * 1000,
+                '\n'.join('%8.3f ms  %s' % (elapsed * 1000, ' '.join(statement.split()))
+                          for elapsed, statement in current['sql'])))
+
+    def observe(self, name, labels, value):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            buckets = next(buckets for metric, _, buckets in HISTOGRAMS if metric == name)
+            histogram = self.histograms[(name, labels)] = Histogram(buckets)
+        histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, description, _ in HISTOGRAMS:
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s histogram' % name)
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        lines.append('%s_bucket{%s} %d' % (
+                            name, format_labels(labels + (('le', format_value(bound)),)), count))
+                    lines.append('%s_sum{%s} %s' % (name, format_labels(labels), format_value(histogram.sum)))
+                    lines.append('%s_count{%s} %d' % (name, format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
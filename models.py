@@ -1,7 +1,10 @@
-from sqlalchemy import Column, String, Integer, UniqueConstraint, ForeignKey, Float, DateTime
+from sqlalchemy import Column, String, Integer, UniqueConstraint, ForeignKey, Float, DateTime, Index, Table, Text, func, \
+    text
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
+from sqlalchemy.schema import CreateColumn
+from datetime import datetime
 
 Base = declarative_base()
 metadata = Base.metadata
@@ -13,8 +16,12 @@ class Sport(Base):
     name = Column('Name', String(255))
 
 
+Index('ix_sport_lower_name', func.lower(Sport.name))
+
+
 class Market(Base):
     __tablename__ = 'market'
+    __table_args__ = (Index('ix_market_sport_id', 'SportId'),)
 
     id = Column('Id', Integer, primary_key=True)
     name = Column('Name', String(255))
@@ -29,6 +36,8 @@ class Market(Base):
 
 class Odd(Base):
     __tablename__ = 'odd'
+    __table_args__ = (Index('ix_odd_market_id_selection_id', 'MarketId', 'SelectionId'),
+                      Index('ix_odd_selection_id', 'SelectionId'))
 
     market_id = Column('MarketId', Integer, ForeignKey('market.Id'), primary_key=True)
     selection_id = Column('SelectionId', Integer, ForeignKey('selection.Id'), primary_key=True)
@@ -50,25 +59,103 @@ class Selection(Base):
     name = Column('Name', String(255))
 
 
+event_market = Table('event_market', metadata,
+                     Column('EventId', Integer, ForeignKey('event.Id'), primary_key=True),
+                     Column('MarketId', Integer, ForeignKey('market.Id'), primary_key=True),
+                     Index('ix_event_market_market_id', 'MarketId'))
+
+
 class Event(Base):
     __tablename__ = 'event'
+    __table_args__ = (Index('ix_event_name', 'Name'),
+                      Index('ix_event_start_time', 'StartTime'),
+                      Index('ix_event_market_id', 'market_id'))
 
     id = Column('Id', Integer, primary_key=True)
     url = Column('URL', String(255))
     name = Column('Name', String(255))
     start_time = Column('StartTime', DateTime)
 
+    # first market of the event, every market (this one included) is linked through event_market
     market = relationship("Market")
     market_id = Column(Integer, ForeignKey('market.Id'))
 
+    # bumped by every write that changes the rendered match, validators of GET /api/match/<id> are built from it
+    version = Column('Version', Integer, nullable=False, default=1, server_default='1')
+    updated_at = Column('UpdatedAt', DateTime)
+
+    markets = relationship("Market", secondary=event_market)
+
     def __repr__(self):
         return "<Event(id:%s,url:%s,name:%s,startTime:%s)>" % (self.id, self.url, self.name, self.start_time)
 
 
+class OddHistory(Base):
+    __tablename__ = 'odd_history'
+    # one selection's prices over a time window are a single range scan of this index
+    __table_args__ = (Index('ix_odd_history_market_id_selection_id_timestamp', 'MarketId', 'SelectionId', 'Timestamp'),)
+
+    id = Column('Id', Integer, primary_key=True)
+    market_id = Column('MarketId', Integer, nullable=False)
+    selection_id = Column('SelectionId', Integer, nullable=False)
+    timestamp = Column('Timestamp', DateTime, nullable=False)
+    odd = Column('Odd', Float)
+
+
 class Message(Base):
     __tablename__ = 'message'
 
     id = Column('Id', Integer, primary_key=True)
     message_type = Column('MessageType', String(255))
     event = relationship("Event")
-    event_id = Column('eventId', Integer, ForeignKey('event.Id'))
\ No newline at end of file
+    event_id = Column('eventId', Integer, ForeignKey('event.Id'))
+
+
+class DataVersion(Base):
+    __tablename__ = 'data_version'
+
+    name = Column('Name', String(32), primary_key=True)
+    version = Column('Version', Integer, nullable=False, default=1)
+    updated_at = Column('UpdatedAt', DateTime)
+
+
+class MatchSnapshot(Base):
+    __tablename__ = 'match_snapshot'
+
+    event_id = Column('EventId', Integer, ForeignKey('event.Id'), primary_key=True)
+    document = Column('Document', Text)
+    # Event.version the document was rendered at, an older snapshot is ignored
+    version = Column('Version', Integer)
+    updated_at = Column('UpdatedAt', DateTime)
+
+
+def add_missing_columns(bind):
+    # create_all only creates missing tables, columns added to a model later are appended here
+    for table in metadata.sorted_tables:
+        existing = {row[1] for row in bind.execute(text('pragma table_info("%s")' % table.name))}
+        for column in table.columns:
+            if column.name not in existing:
+                bind.execute(text('alter table "%s" add column %s' % (table.name,
+                                                                     CreateColumn(column).compile(bind=bind))))
+
+
+def create_indexes(bind):
+    # expression indexes are not reflected by SQLite, so look the names up in sqlite_master instead of checkfirst
+    existing = {row[0] for row in bind.execute(text("select name from sqlite_master where type = 'index'"))}
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=bind)
+
+
+def backfill_event_markets(bind):
+    # events written before event_market existed only know their first market
+    bind.execute(text('insert into event_market ("EventId", "MarketId") '
+                      'select event."Id", event.market_id from event '
+                      'where event.market_id is not null and not exists '
+                      '(select 1 from event_market where event_market."EventId" = event."Id")'))
+
+
+def create_data_versions(bind):
+    bind.execute(text("insert or ignore into data_version (\"Name\", \"Version\", \"UpdatedAt\") "
+                      "values ('listing', 1, :updated_at)"), {'updated_at': datetime.utcnow()})
@@ -0,0 +1,66 @@
+import threading
+
+
+class OddsIndex(object):
+
+    def __init__(self):
+        # (market_id, selection_id) -> odd as last committed; a missing key only means "ask the database"
+        self.prices = {}
+        # (market_id, selection_id) -> number of open transactions writing it
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.skipped = 0
+        self.coalesced = 0
+        self.written = 0
+
+    def warm(self, rows):
+        with self.lock:
+            for market_id, selection_id, odd in rows:
+                self.prices[(market_id, selection_id)] = odd
+
+    def unchanged(self, prices):
+        with self.lock:
+            return self.unchanged_prices(prices)
+
+    def unchanged_prices(self, prices):
+        # a price some open transaction is writing may be about to change, so it is never unchanged
+        return {key for key, odd in prices.items()
+                if key not in self.pending and key in self.prices and self.prices[key] == odd}
+
+    def reserve(self, prices):
+        # returns the unchanged prices and marks the rest as pending in one step, so a concurrent transaction
+        # cannot skip a price this one is about to change; release them once the transaction ends
+        with self.lock:
+            unchanged = self.unchanged_prices(prices)
+            for key in prices:
+                if key not in unchanged:
+                    self.pending[key] = self.pending.get(key, 0) + 1
+            return unchanged
+
+    def release(self, keys):
+        with self.lock:
+            for key in keys:
+                if self.pending.get(key, 0) > 1:
+                    self.pending[key] -= 1
+                else:
+                    self.pending.pop(key, None)
+
+    def update(self, odds):
+        with self.lock:
+            for odd in odds:
+                self.prices[(odd['market_id'], odd['selection_id'])] = odd['odd']
+
+    def count(self, skipped=0, coalesced=0, written=0):
+        with self.lock:
+            self.skipped += skipped
+            self.coalesced += coalesced
+            self.written += written
+
+    def clear(self):
+        with self.lock:
+            self.prices.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.prices), 'pending': len(self.pending), 'written': self.written,
+                    'skipped': self.skipped, 'coalesced': self.coalesced}
@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+import threading
+
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+DEFAULT = 'default'
+
+
+def parse_partitions(spec):
+    # '1,2=sqlite:///football.sqlite3;3=sqlite:///golf.sqlite3' -> {sport id: database url}
+    sport_urls = {}
+    for part in spec.split(';'):
+        if not part.strip():
+            continue
+        sport_ids, _, url = part.partition('=')
+        if not url.strip():
+            raise ValueError('Invalid partition, expected <sport ids>=<database url>: %s' % part)
+        for sport_id in sport_ids.split(','):
+            sport_urls[int(sport_id)] = url.strip()
+    return sport_urls
+
+
+class PartitionSession(object):
+    # stands in for a scoped_session, every call goes to the session of the current partition
+
+    def __init__(self, partitions):
+        self.partitions = partitions
+
+    def __getattr__(self, name):
+        return getattr(self.partitions.sessions[self.partitions.current()], name)
+
+    def remove(self):
+        for sessions in self.partitions.sessions.values():
+            sessions.remove()
+
+
+class Partitions(object):
+
+    def __init__(self, engines, sport_partitions, session_factory):
+        # partition name -> engine, DEFAULT holds every sport without a partition of its own
+        self.engines = engines
+        self.sport_partitions = sport_partitions
+        # sessions of every partition share the factory's class, and so its event listeners
+        self.sessions = {name: scoped_session(sessionmaker(bind=engine, class_=session_factory.class_))
+                         for name, engine in engines.items()}
+        self.local = threading.local()
+        if len(engines) == 1:
+            self.session = self.sessions[DEFAULT]
+            self.pool = None
+        else:
+            self.session = PartitionSession(self)
+            self.pool = ThreadPoolExecutor(len(engines), thread_name_prefix='partition')
+
+    def __len__(self):
+        return len(self.engines)
+
+    def for_sport(self, sport_id):
+        return self.sport_partitions.get(sport_id, DEFAULT)
+
+    def current(self):
+        return getattr(self.local, 'name', DEFAULT)
+
+    def engine(self):
+        return self.engines[self.current()]
+
+    @contextmanager
+    def use(self, name):
+        previous = self.current()
+        self.local.name = name
+        try:
+            yield
+        finally:
+            self.local.name = previous
+
+    def run(self, name, fn):
+        with self.use(name):
+            try:
+                return fn()
+            finally:
+                self.sessions[name].remove()
+
+    def map(self, fn):
+        # runs fn once in every partition, each from its own pool thread; returns (name, result) pairs
+        if self.pool is None:
+            return [(DEFAULT, fn())]
+        names = list(self.engines)
+        return list(zip(names, self.pool.map(partial(self.run, fn=fn), names)))
@@ -0,0 +1,69 @@
+import queue
+import threading
+
+
+class Subscription(object):
+
+    def __init__(self, key, maxsize):
+        self.key = key
+        self.queue = queue.Queue(maxsize)
+        # set by the broker when the buffer overflowed, the consumer has to start over from a fresh read
+        self.dropped = False
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Broker(object):
+
+    def __init__(self, buffer_size=100):
+        self.buffer_size = buffer_size
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, key):
+        subscription = Subscription(key, self.buffer_size)
+        with self.lock:
+            self.subscribers.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.key]
+
+    def has_subscribers(self, key):
+        return key in self.subscribers
+
+    def publish(self, key, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(key, ()))
+            self.published += 1
+        delivered, dropped = 0, []
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+                delivered += 1
+            except queue.Full:
+                subscription.dropped = True
+                dropped.append(subscription)
+        for subscription in dropped:
+            self.unsubscribe(subscription)
+        with self.lock:
+            self.delivered += delivered
+            self.dropped += len(dropped)
+
+    def stats(self):
+        with self.lock:
+            return {'keys': len(self.subscribers), 'subscribers': sum(map(len, self.subscribers.values())),
+                    'buffer_size': self.buffer_size, 'published': self.published, 'delivered': self.delivered,
+                    'dropped': self.dropped}
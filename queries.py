@@ -0,0 +1,162 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import Integer, String, and_, bindparam, func, select, tuple_, type_coerce
+
+from models import *
+
+
+def match_rows_statement():
+    event = Event.__table__
+    market = Market.__table__
+    sport = Sport.__table__
+    odd = Odd.__table__
+    selection = Selection.__table__
+    return select([event.c.Id, event.c.URL, event.c.Name, event.c.StartTime, sport.c.Id, sport.c.Name,
+                   market.c.Id, market.c.Name, selection.c.Id, selection.c.Name, odd.c.Odd]) \
+        .select_from(event.join(event_market, event_market.c.EventId == event.c.Id)
+                          .join(market, market.c.Id == event_market.c.MarketId)
+                          .join(sport, sport.c.Id == market.c.SportId)
+                          .join(odd, odd.c.MarketId == market.c.Id)
+                          .join(selection, selection.c.Id == odd.c.SelectionId))
+
+
+match_statement = match_rows_statement().where(Event.__table__.c.Id == bindparam('event_id'))
+
+matches_rows_statement = match_rows_statement() \
+    .where(Event.__table__.c.Id.in_(bindparam('event_ids', expanding=True)))
+
+
+odds_history_statement = select([OddHistory.__table__.c.Timestamp, OddHistory.__table__.c.Odd]) \
+    .where(and_(OddHistory.__table__.c.MarketId == bindparam('market_id'),
+                OddHistory.__table__.c.SelectionId == bindparam('selection_id'),
+                OddHistory.__table__.c.Timestamp >= bindparam('start'),
+                OddHistory.__table__.c.Timestamp < bindparam('end'))) \
+    .order_by(OddHistory.__table__.c.Timestamp, OddHistory.__table__.c.Id) \
+    .limit(bindparam('limit', type_=Integer))
+
+
+event_version_statement = select([Event.__table__.c.Version, Event.__table__.c.UpdatedAt]) \
+    .where(Event.__table__.c.Id == bindparam('event_id'))
+
+listing_version_statement = select([DataVersion.__table__.c.Version, DataVersion.__table__.c.UpdatedAt]) \
+    .where(DataVersion.__table__.c.Name == 'listing')
+
+
+def match_query(session, id):
+    return session.execute(match_statement, {'event_id': id})
+
+
+def matches_rows_query(session, ids):
+    return session.execute(matches_rows_statement, {'event_ids': list(ids)})
+
+
+def event_version_query(session, id):
+    return session.execute(event_version_statement, {'event_id': id}).first()
+
+
+def odds_history_query(session, market_id, selection_id, start=None, end=None, limit=-1):
+    return session.execute(odds_history_statement, {'market_id': market_id, 'selection_id': selection_id,
+                                                    'start': start or datetime.min, 'end': end or datetime.max,
+                                                    'limit': limit})
+
+
+ORDERINGS = {
+    'id': Event.__table__.c.Id,
+    'url': Event.__table__.c.URL,
+    'name': Event.__table__.c.Name,
+    'starttime': Event.__table__.c.StartTime.desc(),
+}
+
+matches_statements = {}
+
+
+def encode_cursor(start_time, id):
+    return base64.urlsafe_b64encode(json.dumps([start_time, id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        start_time, id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor: %s' % cursor)
+    if not isinstance(start_time, str) or not isinstance(id, int):
+        raise ValueError('Invalid cursor: %s' % cursor)
+    return start_time, id
+
+
+def matches_statement(by_sport=False, by_name=False, ordering=None, paged=False, after_cursor=False):
+    key = (by_sport, by_name, ordering, paged, after_cursor)
+    statement = matches_statements.get(key)
+    if statement is None:
+        event = Event.__table__
+        statement = select([event.c.Id, event.c.URL, event.c.Name, event.c.StartTime])
+        if by_sport:
+            market = Market.__table__
+            sport = Sport.__table__
+            statement = statement.select_from(
+                event.join(market, market.c.Id == event.c.market_id)
+                     .join(sport, and_(sport.c.Id == market.c.SportId,
+                                       func.lower(sport.c.Name) == bindparam('sport_name', type_=String))))
+        if by_name:
+            statement = statement.where(event.c.Name == bindparam('event_name'))
+        if paged:
+            # keyset on the stored StartTime text, so the cursor compares exactly like the index does
+            statement = statement.add_columns(type_coerce(event.c.StartTime, String).label('cursor_start_time'))
+            if after_cursor:
+                statement = statement.where(tuple_(event.c.StartTime, event.c.Id) <
+                                            tuple_(bindparam('cursor_start_time', type_=String),
+                                                   bindparam('cursor_id', type_=Integer)))
+            statement = statement.order_by(event.c.StartTime.desc(), event.c.Id.desc()) \
+                .limit(bindparam('limit', type_=Integer))
+        elif ordering:
+            statement = statement.order_by(ORDERINGS[ordering])
+        matches_statements[key] = statement
+    return statement
+
+
+def matches_query(sport=None, name=None, ordering=None, limit=None, cursor=None):
+    if ordering:
+        ordering = ordering.lower()
+        if ordering not in ORDERINGS:
+            raise ValueError('Unsupported ordering: %s' % ordering)
+
+    params = {}
+    if sport:
+        params['sport_name'] = sport.lower()
+    if name:
+        params['event_name'] = name
+
+    paged = limit is not None
+    if paged:
+        if ordering not in (None, 'starttime'):
+            raise ValueError('Pages are ordered by startTime')
+        if limit < 1:
+            raise ValueError('Invalid limit: %s' % limit)
+        # one extra row tells whether there is a next page
+        params['limit'] = limit + 1
+        if cursor is not None:
+            params['cursor_start_time'], params['cursor_id'] = decode_cursor(cursor)
+
+    return matches_statement(bool(sport), bool(name), ordering or None, paged, paged and cursor is not None), params
+
+
+# column and direction of every ordering, to merge rows of several partitions like the query orders them
+ORDERING_KEYS = {'id': (0, False), 'url': (1, False), 'name': (2, False), 'starttime': (3, True)}
+
+
+def sort_key(value):
+    # NULL sorts first like in SQLite, and is never compared with a value
+    return (0, '') if value is None else (1, value)
+
+
+def merge_matches(results, ordering=None, limit=None):
+    rows = [row for result in results for row in result]
+    if limit is not None:
+        rows.sort(key=lambda row: (row.cursor_start_time, row[0]), reverse=True)
+        return rows[:limit]
+    if ordering:
+        index, reverse = ORDERING_KEYS[ordering.lower()]
+        rows.sort(key=lambda row: sort_key(row[index]), reverse=reverse)
+    return rows
@@ -0,0 +1,119 @@
+import argparse
+import os
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+
+def wait_for_writer(process, authkey, timeout=30):
+    from config import Config
+    from writer import WriterClient, WriterUnavailable
+
+    client = WriterClient(Config.WRITER_ADDRESS, authkey)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('The writer exited with code %d' % process.returncode)
+        try:
+            client.connection()
+            client.close()
+            return
+        except (OSError, EOFError, WriterUnavailable):
+            time.sleep(0.1)
+    raise RuntimeError('The writer did not start in %d seconds' % timeout)
+
+
+def run_writer():
+    import app as api
+    from writer import WriterServer
+
+    api.create_app()
+    server = WriterServer(api.app.config['WRITER_ADDRESS'], api.apply_forwarded_messages,
+                          api.app.config['WRITER_AUTHKEY'])
+    server.bind()
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.close())
+    server.serve_forever()
+
+
+def run_worker(host, fd):
+    from werkzeug.serving import make_server
+    import app as api
+
+    server = make_server(host, None, api.create_app(), threaded=True, fd=fd)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server.serve_forever()
+
+
+def spawn(arguments, env, pass_fds=()):
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__)] + arguments, env=env, pass_fds=pass_fds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run one writer process and several read-only worker processes '
+                                                 'sharing one listening socket.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--topology', choices=('split', 'copies'), default='split',
+                        help='split: one writer and read-only workers; copies: workers that all write, to compare')
+    parser.add_argument('--child', choices=('init', 'writer', 'worker'), help=argparse.SUPPRESS)
+    parser.add_argument('--fd', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == 'init':
+        import app
+        return app.init_db()
+    if args.child == 'writer':
+        return run_writer()
+    if args.child == 'worker':
+        return run_worker(args.host, args.fd)
+
+    processes = []
+    if args.topology == 'split':
+        # the writer and its workers share a secret, an unauthenticated peer could make the writer unpickle anything
+        authkey = os.environ.get('WRITER_AUTHKEY') or secrets.token_hex(32)
+        writer = spawn(['--child', 'writer'], dict(os.environ, ROLE='writer', WRITER_AUTHKEY=authkey))
+        processes.append(writer)
+        wait_for_writer(writer, authkey.encode())
+        worker_env = dict(os.environ, ROLE='reader', WRITER_AUTHKEY=authkey)
+    else:
+        # create the schema once, the workers would race each other for it
+        subprocess.check_call([sys.executable, os.path.abspath(__file__), '--child', 'init'])
+        worker_env = dict(os.environ, ROLE='all', SCHEMA_CHECK='0')
+        if args.workers > 1:
+            # each worker's odds index would miss the prices the others write
+            worker_env['ODDS_INDEX'] = '0'
+
+    listener = socket.socket(socket.AF_INET6 if ':' in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(1024)
+    for _ in range(args.workers):
+        processes.append(spawn(['--child', 'worker', '--host', args.host, '--fd', str(listener.fileno())],
+                               worker_env, pass_fds=(listener.fileno(),)))
+    print('Serving on http://%s:%d with %d %s workers' % (
+        args.host, args.port, args.workers, 'read-only' if args.topology == 'split' else 'read-write'), flush=True)
+
+    def stop(signum=None, frame=None):
+        # workers first, so nothing is forwarded to a writer that is going away
+        for process in reversed(processes):
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while all(process.poll() is None for process in processes):
+            time.sleep(0.5)
+        print('A child process exited, stopping', file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    stop()
+
+
+if __name__ == '__main__':
+    main()
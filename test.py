@@ -1,19 +1,53 @@
 import unittest
+from unittest import mock
+import asyncio
 import requests
-from sqlalchemy import create_engine, and_
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, and_, event, text
 from sqlalchemy.orm import sessionmaker
 from models import *
+from cache import LRUCache
+from duplicates import BloomFilter, DuplicateFilter
+import encoders
+from validation import message_error
+from ingest_queue import IngestQueue
+from logging_config import OddsLogSummary
+from metrics import RequestMetrics
+from odds_index import OddsIndex
+from partitions import DEFAULT, Partitions, parse_partitions
+from pubsub import Broker
+from writer import WriterClient, WriterServer, WriterUnavailable
+import logging
+import app as api
+import asgi_app
+from queries import match_statement, matches_query, merge_matches, odds_history_statement
+import time
+import gzip
+import os
+import subprocess
+import sys
+import tempfile
+import threading
 import json
 from datetime import datetime
 
-Base = declarative_base()
-metadata = Base.metadata
+try:
+    import aiosqlite
+    # the SQLite async dialect is missing from the early SQLAlchemy 1.4 betas
+    import sqlalchemy.dialects.sqlite.aiosqlite
+except ImportError:
+    aiosqlite = None
+
+
+def setUpModule():
+    # the server under test has checked the schema already
+    api.create_app({'SCHEMA_CHECK': False})
+
 
 class TestAPI(unittest.TestCase):
     engine = create_engine('sqlite:///db.sqlite3')
     Session = sessionmaker(bind=engine)
     session = Session()
-    metadata.create_all(engine)
 
     def setUp(self):
         self.sport = Sport(id=1, name='golf')
@@ -30,7 +64,7 @@ class TestAPI(unittest.TestCase):
 
         self.event = Event(id=1, url='http://example.com/api/match/1', name='A vs B vs C',
                            start_time=datetime(2021, 1, 1, 0, 0, 0),
-                           market_id=1)
+                           market_id=1, markets=[self.market])
 
         self.message = Message(id=1, message_type='NewEvent', event_id=1)
 
@@ -61,9 +95,28 @@ class TestAPI(unittest.TestCase):
         message = self.session.query(Message).get(1)
         self.session.delete(message)
 
+        delete_q = MatchSnapshot.__table__.delete().where(MatchSnapshot.event_id.in_((1, 2, 3)))
+        self.session.execute(delete_q)
+
+        delete_q = event_market.delete().where(event_market.c.EventId.in_((1, 2, 3)))
+        self.session.execute(delete_q)
+
+        delete_q = OddHistory.__table__.delete().where(OddHistory.market_id.in_((1, 2, 3)))
+        self.session.execute(delete_q)
+
         self.session.commit()
         self.session.close()
 
+        # rows above are changed behind the API's back, drop whatever the server cached from them
+        requests.delete('http://127.0.0.1:5000/api/cache')
+
+    def update_odds(self, price):
+        return {"id": 1, "message_type": "UpdateOdds",
+                "event": {"id": 1, "name": "A vs B vs C", "startTime": "2021-01-01 00:00:00",
+                          "sport": {"id": 1, "name": "Golf"},
+                          "markets": [{"id": 1, "name": "Winner",
+                                       "selections": [{"id": 1, "name": "A", "odds": price}]}]}}
+
     def test_get_a_match(self):
         url = 'http://127.0.0.1:5000/api/match/1'
 
@@ -109,6 +162,306 @@ class TestAPI(unittest.TestCase):
 
         self.assertEqual(expected_response, json.loads(response.text))
 
+    def test_get_a_match_invalidated_by_update_odds(self):
+        match_url = 'http://127.0.0.1:5000/api/match/1'
+        provider_url = 'http://127.0.0.1:5000/api/external_providers'
+        headers = {'Content-type': 'application/json', 'Accept': 'text/plain'}
+
+        stats = json.loads(requests.get('http://127.0.0.1:5000/api/cache').text)
+        requests.get(match_url, headers=headers)
+        requests.get(match_url, headers=headers)
+        cached = json.loads(requests.get('http://127.0.0.1:5000/api/cache').text)
+        self.assertEqual(stats['hits'] + 1, cached['hits'])
+        self.assertEqual(stats['misses'] + 1, cached['misses'])
+
+        test_payload = {
+            "id": 1,
+            "message_type": "UpdateOdds",
+            "event": {
+                "id": 1,
+                "name": "A vs B vs C",
+                "startTime": "2021-01-01 00:00:00",
+                "sport": {"id": 1, "name": "Golf"},
+                "markets": [{"id": 1, "name": "Winner",
+                             "selections": [{"id": 2, "name": "B", "odds": 7.5}]}]
+            }
+        }
+        requests.put(provider_url, headers=headers, data=json.dumps(test_payload))
+
+        response = requests.get(match_url, headers=headers)
+        selections = json.loads(response.text)['markets'][0]['selections']
+        self.assertEqual([1.01, 7.5, 1.01], [selection['odds'] for selection in selections])
+
+    def test_get_odds_history(self):
+        provider_url = 'http://127.0.0.1:5000/api/external_providers'
+        headers = {'Content-type': 'application/json', 'Accept': 'text/plain'}
+        started = datetime.utcnow()
+        for price in (2.5, 3.0):
+            test_payload = {
+                "id": 1,
+                "message_type": "UpdateOdds",
+                "event": {
+                    "id": 1,
+                    "name": "A vs B vs C",
+                    "startTime": "2021-01-01 00:00:00",
+                    "sport": {"id": 1, "name": "Golf"},
+                    "markets": [{"id": 1, "name": "Winner",
+                                 "selections": [{"id": 1, "name": "A", "odds": price},
+                                                {"id": 2, "name": "B", "odds": 1.5}]}]
+                }
+            }
+            requests.put(provider_url, headers=headers, data=json.dumps(test_payload))
+
+        response = requests.get('http://127.0.0.1:5000/api/odds/1/1')
+        self.assertEqual([2.5, 3.0], [point['odds'] for point in json.loads(response.text)])
+
+        response = requests.get('http://127.0.0.1:5000/api/odds/1/1', params={'limit': 1})
+        self.assertEqual([2.5], [point['odds'] for point in json.loads(response.text)])
+
+        response = requests.get('http://127.0.0.1:5000/api/odds/1/1', params={'to': started.isoformat()})
+        self.assertEqual([], json.loads(response.text))
+
+        response = requests.get('http://127.0.0.1:5000/api/odds/1/1', params={'from': 'yesterday'})
+        self.assertEqual('Invalid time window', response.text)
+
+    def test_resent_prices_are_not_written(self):
+        provider_url = 'http://127.0.0.1:5000/api/external_providers'
+        headers = {'Content-type': 'application/json', 'Accept': 'text/plain'}
+        test_payload = {
+            "id": 1,
+            "message_type": "UpdateOdds",
+            "event": {
+                "id": 1,
+                "name": "A vs B vs C",
+                "startTime": "2021-01-01 00:00:00",
+                "sport": {"id": 1, "name": "Golf"},
+                "markets": [{"id": 1, "name": "Winner",
+                             "selections": [{"id": 1, "name": "A", "odds": 2.5}]}]
+            }
+        }
+        requests.put(provider_url, headers=headers, data=json.dumps(test_payload))
+        stats = json.loads(requests.get('http://127.0.0.1:5000/api/ingest').text)['odds']
+        requests.put(provider_url, headers=headers, data=json.dumps(test_payload))
+        resent = json.loads(requests.get('http://127.0.0.1:5000/api/ingest').text)['odds']
+
+        self.assertEqual(stats['skipped'] + 1, resent['skipped'])
+        self.assertEqual(stats['written'], resent['written'])
+        self.assertEqual(1, self.session.query(OddHistory).filter(OddHistory.market_id == 1).count())
+
+    def test_coalesced_odds_updates(self):
+        api.odds_index.clear()
+        coalesced = api.odds_index.stats()['coalesced']
+        api.app.config['ODDS_COALESCE'] = True
+        try:
+            results = api.apply_messages([self.update_odds(2.0), self.update_odds(4.0)])
+        finally:
+            api.app.config['ODDS_COALESCE'] = False
+            api.session.remove()
+
+        self.assertEqual([{'matched': [1], 'unmatched': [], 'result': 'OK'}] * 2, results)
+        self.assertEqual(coalesced + 1, api.odds_index.stats()['coalesced'])
+        history = self.session.query(OddHistory.odd).filter(OddHistory.market_id == 1).all()
+        self.assertEqual([(4.0,)], history)
+
+    def test_price_restored_within_a_batch_is_written(self):
+        try:
+            api.apply_messages([self.update_odds(1.5)])
+            api.apply_messages([self.update_odds(2.0), self.update_odds(1.5)])
+        finally:
+            api.session.remove()
+
+        self.session.expire_all()
+        odd = self.session.query(Odd).filter(Odd.market_id == 1, Odd.selection_id == 1).one()
+        self.assertEqual(1.5, odd.odd)
+        history = self.session.query(OddHistory.odd).filter(OddHistory.market_id == 1).all()
+        self.assertEqual([(1.5,), (2.0,), (1.5,)], history)
+        self.assertEqual(0, api.odds_index.stats()['pending'])
+
+    def test_stream_odds_changes(self):
+        stream = requests.get('http://127.0.0.1:5000/api/match/1/stream', stream=True, timeout=5)
+        lines = stream.iter_lines(chunk_size=1, decode_unicode=True)
+        self.assertEqual(': subscribed', next(lines))
+
+        test_payload = {
+            "id": 1,
+            "message_type": "UpdateOdds",
+            "event": {
+                "id": 1,
+                "name": "A vs B vs C",
+                "startTime": "2021-01-01 00:00:00",
+                "sport": {"id": 1, "name": "Golf"},
+                "markets": [{"id": 1, "name": "Winner",
+                             "selections": [{"id": 2, "name": "B", "odds": 4.5}]}]
+            }
+        }
+        requests.put('http://127.0.0.1:5000/api/external_providers',
+                     headers={'Content-type': 'application/json'}, data=json.dumps(test_payload))
+
+        events = (line for line in lines if line and not line.startswith(':'))
+        self.assertEqual('event: odds', next(events))
+        self.assertEqual({'id': 1, 'markets': [{'id': 1, 'selections': [{'id': 2, 'odds': 4.5}]}]},
+                         json.loads(next(events)[len('data: '):]))
+        stream.close()
+
+    def test_get_a_match_not_modified(self):
+        match_url = 'http://127.0.0.1:5000/api/match/1'
+        response = requests.get(match_url)
+        etag = response.headers['ETag']
+
+        response = requests.get(match_url, headers={'If-None-Match': etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('', response.text)
+
+        test_payload = {
+            "id": 1,
+            "message_type": "UpdateOdds",
+            "event": {
+                "id": 1,
+                "name": "A vs B vs C",
+                "startTime": "2021-01-01 00:00:00",
+                "sport": {"id": 1, "name": "Golf"},
+                "markets": [{"id": 1, "name": "Winner",
+                             "selections": [{"id": 3, "name": "C", "odds": 9.0}]}]
+            }
+        }
+        requests.put('http://127.0.0.1:5000/api/external_providers',
+                     headers={'Content-type': 'application/json'}, data=json.dumps(test_payload))
+
+        response = requests.get(match_url, headers={'If-None-Match': etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers['ETag'])
+        self.assertIn('Last-Modified', response.headers)
+        self.assertEqual(9.0, json.loads(response.text)['markets'][0]['selections'][2]['odds'])
+
+    def test_get_a_match_modified_within_the_same_second(self):
+        client = api.app.test_client()
+        try:
+            api.apply_messages([self.update_odds(2.0)])
+            last_modified = client.get('/api/match/1').headers['Last-Modified']
+            unchanged = client.get('/api/match/1', headers={'If-Modified-Since': last_modified})
+            api.apply_messages([self.update_odds(3.0)])
+            response = client.get('/api/match/1', headers={'If-Modified-Since': last_modified})
+            echoed = client.get('/api/match/1', headers={'If-Modified-Since': response.headers['Last-Modified']})
+        finally:
+            api.session.remove()
+
+        self.assertEqual(304, unchanged.status_code)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3.0, json.loads(response.data)['markets'][0]['selections'][0]['odds'])
+        self.assertNotEqual(last_modified, response.headers['Last-Modified'])
+        self.assertEqual(304, echoed.status_code)
+
+    def test_get_matches_not_modified(self):
+        url = 'http://127.0.0.1:5000/api/match/?sport=golf'
+        etag = requests.get(url).headers['ETag']
+        self.assertEqual(304, requests.get(url, headers={'If-None-Match': etag}).status_code)
+
+        test_payload = {
+            "id": 2,
+            "message_type": "NewEvent",
+            "event": {
+                "id": 2,
+                "name": "D vs E",
+                "startTime": "2021-01-02 00:00:00",
+                "sport": {"id": 1, "name": "golf"},
+                "markets": [{"id": 2, "name": "Winner", "selections": [{"id": 4, "name": "D", "odds": 1.5}]}]
+            }
+        }
+        requests.post('http://127.0.0.1:5000/api/external_providers',
+                      headers={'Content-type': 'application/json'}, data=json.dumps(test_payload))
+
+        response = requests.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([1, 2], sorted(match['id'] for match in json.loads(response.text)))
+
+        # delete posted testing data
+        self.session.execute(Selection.__table__.delete().where(Selection.id == 4))
+        self.session.execute(Odd.__table__.delete().where(Odd.market_id == 2))
+        self.session.execute(Market.__table__.delete().where(Market.id == 2))
+        self.session.execute(Event.__table__.delete().where(Event.id == 2))
+        self.session.execute(Message.__table__.delete().where(Message.id == 2))
+        self.session.commit()
+
+    def test_get_matches_gzip(self):
+        client = api.app.test_client()
+        api.app.config['GZIP_MIN_SIZE'] = 0
+        try:
+            compressed = client.get('/api/match/', headers={'Accept-Encoding': 'gzip'})
+            plain = client.get('/api/match/')
+        finally:
+            api.app.config['GZIP_MIN_SIZE'] = 1024
+            api.session.remove()
+
+        self.assertEqual('gzip', compressed.headers['Content-Encoding'])
+        self.assertEqual('Accept, Accept-Encoding', compressed.headers['Vary'])
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.data, gzip.decompress(compressed.data))
+
+    def test_no_stream_on_readers(self):
+        api.app.config['ROLE'] = 'reader'
+        try:
+            response = api.app.test_client().get('/api/match/1/stream')
+        finally:
+            api.app.config['ROLE'] = 'all'
+        self.assertEqual(404, response.status_code)
+        self.assertEqual(0, api.broker.stats()['subscribers'])
+
+    def test_cached_match_is_compressed_once(self):
+        client = api.app.test_client()
+        api.app.config['GZIP_MIN_SIZE'] = 0
+        api.match_cache.clear()
+        try:
+            with mock.patch.object(api.gzip, 'compress', wraps=gzip.compress) as compress:
+                first = client.get('/api/match/1', headers={'Accept-Encoding': 'gzip'})
+                second = client.get('/api/match/1', headers={'Accept-Encoding': 'gzip'})
+        finally:
+            api.app.config['GZIP_MIN_SIZE'] = 1024
+            api.session.remove()
+
+        self.assertEqual(1, compress.call_count)
+        self.assertEqual('gzip', second.headers['Content-Encoding'])
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(1, json.loads(gzip.decompress(second.data))['id'])
+
+    def test_create_app_runs_once(self):
+        self.assertIs(api.app, api.create_app())
+        with self.assertRaises(RuntimeError):
+            api.create_app({'MATCH_CACHE_SIZE': 0})
+
+    def test_rebuild_snapshots(self):
+        result = api.app.test_cli_runner().invoke(args=['rebuild-snapshots'])
+        self.assertEqual(0, result.exit_code)
+
+        document = self.session.query(MatchSnapshot.document).filter(MatchSnapshot.event_id == 1).scalar()
+        expected_document = {
+            "id": 1,
+            "url": "http://example.com/api/match/1",
+            "name": "A vs B vs C",
+            "startTime": "2021-01-01 00:00:00",
+            "sport": {"id": 1, "name": "golf"},
+            "markets": [{"id": 1, "name": "Winner",
+                         "selections": [{"id": 1, "name": "A", "odds": 1.01},
+                                        {"id": 2, "name": "B", "odds": 1.01},
+                                        {"id": 3, "name": "C", "odds": 1.01}]}]
+        }
+        self.assertEqual(expected_document, json.loads(document))
+
+    def test_outdated_snapshot_is_not_served(self):
+        client = api.app.test_client()
+        api.app.config['MATCH_SNAPSHOTS'] = True
+        try:
+            api.apply_messages([self.update_odds(1.5)])
+            api.app.config['MATCH_SNAPSHOTS'] = False
+            api.apply_messages([self.update_odds(9.0)])
+            api.app.config['MATCH_SNAPSHOTS'] = True
+            api.match_cache.clear()
+            response = client.get('/api/match/1')
+        finally:
+            api.app.config['MATCH_SNAPSHOTS'] = False
+            api.session.remove()
+
+        self.assertEqual(9.0, json.loads(response.data)['markets'][0]['selections'][0]['odds'])
+
     def test_get_a_match_not_exists(self):
 
         url = 'http://127.0.0.1:5000/api/match/100'
@@ -160,6 +513,58 @@ class TestAPI(unittest.TestCase):
 
         self.assertEqual(expected_response, json.loads(response.text))
 
+    def test_get_matches_pages(self):
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+
+        response = requests.get('http://127.0.0.1:5000/api/match/?ordering=startTime', headers=headers)
+        expected_ids = [match['id'] for match in json.loads(response.text)]
+
+        ids = []
+        url = 'http://127.0.0.1:5000/api/match/?limit=1'
+        while True:
+            response = requests.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            page = json.loads(response.text)
+            self.assertEqual(1, len(page))
+            ids.extend(match['id'] for match in page)
+            cursor = response.headers.get('X-Next-Cursor')
+            if cursor is None:
+                break
+            url = 'http://127.0.0.1:5000/api/match/?limit=1&cursor=%s' % cursor
+
+        self.assertEqual(expected_ids, ids)
+
+        response = requests.get('http://127.0.0.1:5000/api/match/?cursor=not-a-cursor', headers=headers)
+        self.assertEqual('Cannot complete the query', response.text)
+
+    def test_get_matches_ndjson(self):
+        url = 'http://127.0.0.1:5000/api/match/?sport=Golf'
+        headers = {'Accept': 'application/x-ndjson'}
+
+        response = requests.get(url, headers=headers, stream=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual('application/x-ndjson', response.headers['Content-Type'])
+
+        expected_response = [{"id": 1, "url": "http://example.com/api/match/1", "name": "A vs B vs C",
+                              "startTime": "2021-01-01 00:00:00"}]
+        self.assertEqual(expected_response, [json.loads(line) for line in response.iter_lines() if line])
+
+    def test_get_matches_query_parameters_are_not_sql(self):
+        headers = {'Content-type': 'application/json', 'Accept': 'text/plain'}
+
+        url = "http://127.0.0.1:5000/api/match/?name=x' or '1'='1"
+        response = requests.get(url, headers=headers)
+        self.assertEqual('No match on current query conditions', response.text)
+
+        url = "http://127.0.0.1:5000/api/match/?sport=golf' or '1'='1"
+        response = requests.get(url, headers=headers)
+        self.assertEqual('No match on current query conditions', response.text)
+
+        url = 'http://127.0.0.1:5000/api/match/?ordering=id;%20delete%20from%20event'
+        response = requests.get(url, headers=headers)
+        self.assertEqual('Cannot complete the query', response.text)
+
     def test_post_new_event(self):
         url = 'http://127.0.0.1:5000/api/external_providers'
 
@@ -238,6 +643,48 @@ class TestAPI(unittest.TestCase):
 
         self.session.commit()
 
+    def test_post_and_update_event_with_several_markets(self):
+        provider_url = 'http://127.0.0.1:5000/api/external_providers'
+        headers = {'Content-type': 'application/json', 'Accept': 'text/plain'}
+        event = {
+            "id": 2,
+            "name": "D vs E",
+            "startTime": "2021-01-02 00:00:00",
+            "sport": {"id": 1, "name": "golf"},
+            "markets": [{"id": 2, "name": "Winner",
+                         "selections": [{"id": 4, "name": "D", "odds": 1.5}, {"id": 5, "name": "E", "odds": 2.5}]},
+                        {"id": 3, "name": "Place",
+                         "selections": [{"id": 6, "name": "D or E", "odds": 1.1}]}]
+        }
+        response = requests.post(provider_url, headers=headers,
+                                 data=json.dumps({"id": 2, "message_type": "NewEvent", "event": event}))
+        self.assertEqual('OK', response.text)
+
+        event['markets'][0]['selections'][1]['odds'] = 3.0
+        event['markets'][1]['selections'][0]['odds'] = 1.2
+        response = requests.put(provider_url, headers=headers,
+                                data=json.dumps({"id": 3, "message_type": "UpdateOdds", "event": event}))
+        self.assertEqual('OK', response.text)
+
+        markets = self.session.query(event_market.c.MarketId).filter(event_market.c.EventId == 2) \
+            .order_by(event_market.c.MarketId).all()
+        self.assertEqual([(2,), (3,)], markets)
+
+        response = requests.get('http://127.0.0.1:5000/api/match/2')
+        self.assertEqual([{'id': 2, 'name': 'Winner',
+                           'selections': [{'id': 4, 'name': 'D', 'odds': 1.5}, {'id': 5, 'name': 'E', 'odds': 3.0}]},
+                          {'id': 3, 'name': 'Place',
+                           'selections': [{'id': 6, 'name': 'D or E', 'odds': 1.2}]}],
+                         json.loads(response.text)['markets'])
+
+        # delete posted testing data
+        self.session.execute(Selection.__table__.delete().where(Selection.id.in_((4, 5, 6))))
+        self.session.execute(Odd.__table__.delete().where(Odd.market_id.in_((2, 3))))
+        self.session.execute(Market.__table__.delete().where(Market.id.in_((2, 3))))
+        self.session.execute(Event.__table__.delete().where(Event.id == 2))
+        self.session.execute(Message.__table__.delete().where(Message.id == 2))
+        self.session.commit()
+
     def test_post_new_event_with_new_sport(self):
         url = 'http://127.0.0.1:5000/api/external_providers'
 
@@ -355,6 +802,54 @@ class TestAPI(unittest.TestCase):
         count = self.session.query(Message).filter(Message.id == 1).count()
         self.assertEqual(1, count)
 
+    def test_resent_message_is_rejected_from_memory(self):
+        url = 'http://127.0.0.1:5000/api/external_providers/batch'
+        message = {"id": 2, "message_type": "NewEvent",
+                   "event": {"id": 2, "name": "D vs E", "startTime": "2021-01-02 00:00:00",
+                             "sport": {"id": 1, "name": "Golf"},
+                             "markets": [{"id": 1, "name": "Winner",
+                                          "selections": [{"id": 1, "name": "A", "odds": 1.01}]}]}}
+
+        self.assertEqual([{"id": 2, "result": "OK"}], json.loads(requests.post(url, data=json.dumps([message])).text))
+        stats = json.loads(requests.get('http://127.0.0.1:5000/api/ingest').text)['duplicates']
+        rejected = stats['rejected_from_memory']
+        self.assertEqual([{"id": 2, "result": "Duplicate"}],
+                         json.loads(requests.post(url, data=json.dumps([message])).text))
+        stats = json.loads(requests.get('http://127.0.0.1:5000/api/ingest').text)['duplicates']
+        self.assertEqual(rejected + 2, stats['rejected_from_memory'])
+        self.assertGreater(stats['memory_bytes'], 0)
+
+        self.session.execute(Event.__table__.delete().where(Event.id == 2))
+        self.session.execute(Message.__table__.delete().where(Message.id == 2))
+        self.session.commit()
+
+    def test_resent_message_runs_no_query(self):
+        message = {"id": 2, "message_type": "NewEvent",
+                   "event": {"id": 2, "name": "D vs E", "startTime": "2021-01-02 00:00:00",
+                             "sport": {"id": 1, "name": "Golf"},
+                             "markets": [{"id": 1, "name": "Winner",
+                                          "selections": [{"id": 1, "name": "A", "odds": 1.01}]}]}}
+        statements = []
+
+        def count(*arguments):
+            statements.append(arguments[2])
+
+        try:
+            self.assertEqual(['OK'], api.apply_messages([message]))
+            event.listen(api.engine, 'before_cursor_execute', count)
+            try:
+                self.assertEqual(['Duplicate'], api.apply_messages([message]))
+                self.assertEqual(['Duplicate'], api.add_new_events([message]))
+            finally:
+                event.remove(api.engine, 'before_cursor_execute', count)
+        finally:
+            api.session.remove()
+            self.session.execute(Event.__table__.delete().where(Event.id == 2))
+            self.session.execute(Message.__table__.delete().where(Message.id == 2))
+            self.session.commit()
+
+        self.assertEqual([], statements)
+
     def test_put_update_odds(self):
         url = 'http://127.0.0.1:5000/api/external_providers'
 
@@ -567,8 +1062,789 @@ class TestAPI(unittest.TestCase):
 
         response = requests.put(url, headers=headers, data=data)
 
-        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, 'Can not parse the message')
+
+    def test_post_batch_new_events(self):
+        url = 'http://127.0.0.1:5000/api/external_providers/batch'
+
+        test_payload = [
+            {
+                "id": 2,
+                "message_type": "NewEvent",
+                "event": {
+                    "id": 2,
+                    "name": "D vs E",
+                    "startTime": "2021-01-02 00:00:00",
+                    "sport": {
+                        "id": 1,
+                        "name": "Golf"
+                    },
+                    "markets": [
+                        {
+                            "id": 2,
+                            "name": "Winner",
+                            "selections": [
+                                {
+                                    "id": 4,
+                                    "name": "D",
+                                    "odds": 1.01
+                                },
+                                {
+                                    "id": 5,
+                                    "name": "E",
+                                    "odds": 1.01
+                                }
+                            ]
+                        }
+                    ]
+                }
+            },
+            {
+                "id": 3,
+                "message_type": "NewEvent",
+                "event": {
+                    "id": 3,
+                    "name": "F vs E",
+                    "startTime": "2021-01-03 00:00:00",
+                    "sport": {
+                        "id": 100,
+                        "name": "Rugby"
+                    },
+                    "markets": [
+                        {
+                            "id": 3,
+                            "name": "Winner",
+                            "selections": [
+                                {
+                                    "id": 6,
+                                    "name": "F",
+                                    "odds": 2.5
+                                },
+                                {
+                                    "id": 5,
+                                    "name": "E",
+                                    "odds": 1.5
+                                }
+                            ]
+                        }
+                    ]
+                }
+            },
+            {
+                "id": 1,
+                "message_type": "NewEvent",
+                "event": {
+                    "id": 1,
+                    "name": "A vs B vs C",
+                    "startTime": "2021-01-01 00:00:00",
+                    "sport": {
+                        "id": 1,
+                        "name": "Golf"
+                    },
+                    "markets": [
+                        {
+                            "id": 1,
+                            "name": "Winner",
+                            "selections": [
+                                {
+                                    "id": 1,
+                                    "name": "A",
+                                    "odds": 1.01
+                                }
+                            ]
+                        }
+                    ]
+                }
+            },
+            {
+                "id": 4,
+                "message_type": "NewEvent"
+            }
+        ]
+
+        data = json.dumps(test_payload)
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+
+        response = requests.post(url, headers=headers, data=data)
+
+        self.assertEqual(response.status_code, 200)
+
+        expected_response = [{"id": 2, "result": "OK"},
+                             {"id": 3, "result": "OK"},
+                             {"id": 1, "result": "Duplicate"},
+                             {"id": 4, "result": "Can not parse the message", "error": "event"}]
+        self.assertEqual(expected_response, json.loads(response.text))
+
+        messages = self.session.query(Message.id, Message.event_id).filter(Message.id.in_((2, 3))).all()
+        self.assertListEqual([(2, 2), (3, 3)], messages)
+
+        sport = self.session.query(Sport.id, Sport.name).filter(Sport.id == 100).first()
+        self.assertEqual((100, 'Rugby'), sport)
+
+        selection = self.session.query(Selection.id, Selection.name).filter(Selection.id.in_((4, 5, 6))).all()
+        self.assertListEqual([(4, 'D'), (5, 'E'), (6, 'F')], selection)
+
+        odd = self.session.query(Odd.market_id, Odd.selection_id, Odd.odd) \
+            .filter(Odd.market_id.in_((2, 3))).order_by(Odd.market_id, Odd.selection_id).all()
+        self.assertListEqual([(2, 4, 1.01), (2, 5, 1.01), (3, 5, 1.5), (3, 6, 2.5)], odd)
+
+        # delete posted testing data
+        self.session.execute(Selection.__table__.delete().where(Selection.id.in_((4, 5, 6))))
+        self.session.execute(Odd.__table__.delete().where(Odd.market_id.in_((2, 3))))
+        self.session.execute(Market.__table__.delete().where(Market.id.in_((2, 3))))
+        self.session.execute(Sport.__table__.delete().where(Sport.id == 100))
+        self.session.execute(Event.__table__.delete().where(Event.id.in_((2, 3))))
+        self.session.execute(Message.__table__.delete().where(Message.id.in_((2, 3))))
+        self.session.commit()
+
+    def test_put_batch_ndjson_update_odds(self):
+        url = 'http://127.0.0.1:5000/api/external_providers/batch'
+
+        messages = [
+            {"id": 1, "message_type": "UpdateOdds",
+             "event": {"id": 1, "name": "A vs B vs C", "startTime": "2021-01-01 00:00:00",
+                       "sport": {"id": 1, "name": "Golf"},
+                       "markets": [{"id": 1, "name": "Winner",
+                                    "selections": [{"id": 1, "name": "A", "odds": 3.0}]}]}},
+            {"id": 1, "message_type": "UpdateOdds",
+             "event": {"id": 1, "name": "A vs B vs C", "startTime": "2021-01-01 00:00:00",
+                       "sport": {"id": 1, "name": "Golf"},
+                       "markets": [{"id": 1, "name": "Winner",
+                                    "selections": [{"id": 1, "name": "A", "odds": 4.0},
+                                                   {"id": 2, "name": "B", "odds": 2.0}]}]}},
+            {"id": 1, "message_type": "UpdateOdds",
+             "event": {"id": 1, "name": "A vs B vs C", "startTime": "2021-01-01 00:00:00",
+                       "sport": {"id": 1, "name": "Golf"},
+                       "markets": [{"id": 1, "name": "Winner",
+                                    "selections": [{"id": 9, "name": "Z", "odds": 2.0}]}]}},
+            {"id": 1, "message_type": "UpdateOdds",
+             "event": {"id": 1, "name": "A vs B vs C", "startTime": "2021-01-01 00:00:00",
+                       "sport": {"id": 1, "name": "Golf"},
+                       "markets": [{"id": 999, "name": "Winner",
+                                    "selections": [{"id": 1, "name": "A", "odds": 2.0}]}]}}
+        ]
+
+        data = '\n'.join(json.dumps(message) for message in messages)
+        headers = {'Content-type': 'application/x-ndjson', 'Accept': 'application/json'}
+
+        response = requests.put(url, headers=headers, data=data)
+
+        self.assertEqual(response.status_code, 200)
+        expected_response = [{"id": 1, "result": "OK", "matched": [1], "unmatched": []},
+                             {"id": 1, "result": "OK", "matched": [1, 2], "unmatched": []},
+                             {"id": 1, "result": "OK", "matched": [], "unmatched": [9]},
+                             {"id": 1, "result": "Invalid market"}]
+        self.assertEqual(expected_response, json.loads(response.text))
+
+        res = self.session.query(Odd.odd). \
+            filter(and_(Odd.selection_id.in_((1, 2, 3)), Odd.market_id == 1)) \
+            .order_by(Odd.selection_id).all()
+
+        self.assertListEqual(res, [(4.0,), (2.0,), (1.01,)])
+
+    def test_concurrent_gets_and_puts(self):
+        match_url = 'http://127.0.0.1:5000/api/match/1'
+        provider_url = 'http://127.0.0.1:5000/api/external_providers'
+        headers = {'Content-type': 'application/json', 'Accept': 'text/plain'}
+        prices = [round(1.5 + i / 10.0, 2) for i in range(40)]
+
+        def get_match(_):
+            response = requests.get(match_url, headers=headers)
+            return response.status_code, json.loads(response.text)['id']
+
+        def put_odds(price):
+            test_payload = {
+                "id": 1,
+                "message_type": "UpdateOdds",
+                "event": {
+                    "id": 1,
+                    "name": "A vs B vs C",
+                    "startTime": "2021-01-01 00:00:00",
+                    "sport": {"id": 1, "name": "Golf"},
+                    "markets": [{"id": 1, "name": "Winner",
+                                 "selections": [{"id": 1, "name": "A", "odds": price}]}]
+                }
+            }
+            response = requests.put(provider_url, headers=headers, data=json.dumps(test_payload))
+            return response.status_code, response.text
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            gets = executor.map(get_match, range(200))
+            puts = executor.map(put_odds, prices)
+            get_results, put_results = list(gets), list(puts)
+
+        self.assertEqual([(200, 1)] * 200, get_results)
+        self.assertEqual([(200, 'OK')] * len(prices), put_results)
+
+        odd = self.session.query(Odd.odd).filter(and_(Odd.selection_id == 1, Odd.market_id == 1)).scalar()
+        self.assertIn(odd, prices)
+
+    def test_metrics(self):
+        requests.get('http://127.0.0.1:5000/api/match/1')
+        response = requests.get('http://127.0.0.1:5000/metrics')
+
+        self.assertEqual(200, response.status_code)
+        self.assertIn('# TYPE http_request_db_statements histogram', response.text)
+        self.assertIn('http_request_db_statements_count{method="GET",route="/api/match/<int:id>"}', response.text)
+        self.assertIn('http_request_serialization_seconds_bucket{method="GET",route="/api/match/<int:id>",le="+Inf"}',
+                      response.text)
+
+
+@unittest.skipIf(aiosqlite is None, 'asgi_app.py needs the packages in requirements-async.txt')
+class TestASGI(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.config = dict(asgi_app.config)
+        cls.handlers = list(logging.getLogger().handlers)
+        asgi_app.config.update(DATABASE_URL='sqlite:///%s' % os.path.join(cls.directory, 'asgi.sqlite3'),
+                               ASYNC_DATABASE_URL=None, LOG_FILE=os.path.join(cls.directory, 'api.log'),
+                               LOG_QUEUE=False, SCHEMA_CHECK=True)
+        cls.engine = create_engine(asgi_app.config['DATABASE_URL'])
+        cls.loop = asyncio.new_event_loop()
+        cls.lifespan_events = cls.loop.run_until_complete(cls.start_lifespan())
+        reply = cls.loop.run_until_complete(cls.lifespan_event('lifespan.startup'))
+        if reply['type'] != 'lifespan.startup.complete':
+            # tearDownClass only runs after a successful setUpClass, and the failed app waits for no shutdown
+            cls.restore()
+            raise AssertionError('asgi_app.py did not start: %s' % reply.get('message'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.run_until_complete(cls.lifespan_event('lifespan.shutdown'))
+        cls.restore()
+
+    @classmethod
+    def restore(cls):
+        cls.loop.close()
+        cls.engine.dispose()
+        for handler in logging.getLogger().handlers:
+            if handler not in cls.handlers:
+                logging.getLogger().removeHandler(handler)
+                handler.close()
+        asgi_app.config.clear()
+        asgi_app.config.update(cls.config)
+
+    @classmethod
+    async def start_lifespan(cls):
+        events, replies = asyncio.Queue(), asyncio.Queue()
+        cls.lifespan_task = asyncio.ensure_future(asgi_app.app({'type': 'lifespan'}, events.get, replies.put))
+        return events, replies
+
+    @classmethod
+    async def lifespan_event(cls, name):
+        events, replies = cls.lifespan_events
+        await events.put({'type': name})
+        return await replies.get()
+
+    def request(self, method, path, body=None, query=''):
+        body = json.dumps(body).encode() if body is not None else b''
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+                 'headers': [(b'content-type', b'application/json')]}
+        self.loop.run_until_complete(asgi_app.app(scope, receive, send))
+        return messages[0]['status'], messages[1]['body'].decode()
+
+    def new_event(self, message_id, event_id, market_id, odds):
+        return {"id": message_id, "message_type": "NewEvent",
+                "event": {"id": event_id, "name": "A vs B", "startTime": "2021-01-01 00:00:00",
+                          "sport": {"id": 1, "name": "Golf"},
+                          "markets": [{"id": market_id, "name": "Winner",
+                                       "selections": [{"id": 1, "name": "A", "odds": odds},
+                                                      {"id": 2, "name": "B", "odds": 3.0}]}]}}
+
+    def test_import_touches_nothing(self):
+        code = 'import asgi_app, os; print(asgi_app.engine, os.path.exists(asgi_app.config["LOG_FILE"]))'
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         env=dict(os.environ, LOG_FILE=os.path.join(self.directory, 'import.log')))
+        self.assertEqual('None False', output.decode().strip())
+
+    def test_new_event(self):
+        self.assertEqual((200, 'OK'), self.request('POST', '/api/external_providers', self.new_event(10, 10, 10, 1.5)))
+        # a resent message is not written twice
+        self.assertEqual((200, 'OK'), self.request('POST', '/api/external_providers', self.new_event(10, 10, 10, 1.5)))
+
+        status, body = self.request('GET', '/api/match/10')
+        self.assertEqual(200, status)
+        match = json.loads(body)
+        self.assertEqual([{'id': 1, 'name': 'A', 'odds': 1.5}, {'id': 2, 'name': 'B', 'odds': 3.0}],
+                         match['markets'][0]['selections'])
+        with self.engine.connect() as connection:
+            self.assertEqual(1, connection.execute(text('SELECT COUNT(*) FROM message WHERE Id = 10')).scalar())
+            self.assertEqual([(10, 10)], connection.execute(
+                text('SELECT EventId, MarketId FROM event_market WHERE EventId = 10')).fetchall())
+            self.assertEqual(2, connection.execute(
+                text('SELECT COUNT(*) FROM odd_history WHERE MarketId = 10')).scalar())
+
+    def test_update_odds(self):
+        self.request('POST', '/api/external_providers', self.new_event(20, 20, 20, 1.5))
+        update = {"id": 21, "message_type": "UpdateOdds",
+                  "event": {"id": 20, "name": "A vs B", "startTime": "2021-01-01 00:00:00",
+                            "sport": {"id": 1, "name": "Golf"},
+                            "markets": [{"id": 20, "name": "Winner",
+                                         "selections": [{"id": 1, "name": "A", "odds": 2.5}]}]}}
+        self.assertEqual((200, 'OK'), self.request('PUT', '/api/external_providers', update))
+
+        match = json.loads(self.request('GET', '/api/match/20')[1])
+        self.assertEqual(2.5, match['markets'][0]['selections'][0]['odds'])
+        with self.engine.connect() as connection:
+            self.assertEqual(2, connection.execute(text('SELECT Version FROM event WHERE Id = 20')).scalar())
+            self.assertEqual([(1.5,), (2.5,)], connection.execute(text(
+                'SELECT Odd FROM odd_history WHERE MarketId = 20 AND SelectionId = 1 ORDER BY Id')).fetchall())
+
+    def test_unknown_route(self):
+        self.assertEqual(404, self.request('GET', '/api/unknown')[0])
+        self.assertEqual(405, self.request('DELETE', '/api/match/1')[0])
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        cache = LRUCache(maxsize=2)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, 'one')
+        self.assertEqual('one', cache.get(1))
+        self.assertEqual((1, 1), (cache.stats()['hits'], cache.stats()['misses']))
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set(1, 'one')
+        cache.set(2, 'two')
+        cache.get(1)
+        cache.set(3, 'three')
+        self.assertIsNone(cache.get(2))
+        self.assertEqual('one', cache.get(1))
+        self.assertEqual(1, cache.stats()['evictions'])
+
+    def test_expires_after_ttl(self):
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.set(1, 'one')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(1, cache.stats()['expirations'])
+
+    def test_set_after_invalidate_is_dropped(self):
+        cache = LRUCache(maxsize=2)
+        version = cache.version
+        cache.invalidate(1)
+        cache.set(1, 'stale', version)
+        self.assertIsNone(cache.get(1))
+
+
+class TestOddsIndex(unittest.TestCase):
+
+    def test_unchanged_prices(self):
+        index = OddsIndex()
+        index.warm([(1, 1, 1.5), (1, 2, 2.5)])
+        self.assertEqual({(1, 1)}, index.unchanged({(1, 1): 1.5, (1, 2): 3.0, (1, 3): 1.5}))
+
+    def test_pending_prices_are_never_unchanged(self):
+        index = OddsIndex()
+        index.warm([(1, 1, 1.5)])
+        self.assertEqual(set(), index.reserve({(1, 1): 2.0}))
+        self.assertEqual(set(), index.reserve({(1, 1): 1.5}))
+        index.release([(1, 1)])
+        self.assertEqual(set(), index.unchanged({(1, 1): 1.5}))
+        index.release([(1, 1)])
+        self.assertEqual({(1, 1)}, index.unchanged({(1, 1): 1.5}))
+
+    def test_update_and_clear(self):
+        index = OddsIndex()
+        index.update([{'market_id': 1, 'selection_id': 1, 'odd': 2.0}])
+        self.assertEqual({(1, 1)}, index.unchanged({(1, 1): 2.0}))
+        index.clear()
+        self.assertEqual(set(), index.unchanged({(1, 1): 2.0}))
+
+
+class TestDuplicateFilter(unittest.TestCase):
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(b'%d' % i)
+        self.assertTrue(all(b'%d' % i in bloom for i in range(1000)))
+        false_positives = sum(b'x%d' % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+        self.assertAlmostEqual(0.01, bloom.expected_error_rate(), delta=0.005)
+
+    def test_classify(self):
+        duplicates = DuplicateFilter(capacity=1000, error_rate=0.001, recent_size=2)
+        duplicates.add('message', [1], recent=False)
+        duplicates.add('message', [2, 3, 4])
+        seen, possible = duplicates.classify('message', {1, 3, 4, 5})
+        self.assertEqual({3, 4}, seen)
+        self.assertEqual({1}, possible)
+        self.assertEqual((set(), set()), duplicates.classify('event', {3}))
+
+        duplicates.confirmed(possible, set())
+        duplicates.clear_recent()
+        self.assertEqual((set(), {3, 4}), duplicates.classify('message', {3, 4}))
+        stats = duplicates.stats()
+        self.assertEqual(2, stats['rejected_from_memory'])
+        self.assertEqual(2, stats['lookups_skipped'])
+        self.assertEqual(1 / 3, stats['false_positive_rate'])
+
+
+class TestBroker(unittest.TestCase):
+
+    def test_fan_out(self):
+        broker = Broker()
+        first, second, other = broker.subscribe(1), broker.subscribe(1), broker.subscribe(2)
+        broker.publish(1, 'odds')
+        self.assertEqual('odds', first.get(0))
+        self.assertEqual('odds', second.get(0))
+        self.assertIsNone(other.get(0))
+
+    def test_slow_consumer_is_dropped(self):
+        broker = Broker(buffer_size=2)
+        slow, fast = broker.subscribe(1), broker.subscribe(1)
+        for i in range(3):
+            broker.publish(1, i)
+            fast.get(0)
+
+        self.assertTrue(slow.dropped)
+        self.assertFalse(fast.dropped)
+        self.assertEqual({'keys': 1, 'subscribers': 1, 'buffer_size': 2, 'published': 3, 'delivered': 5,
+                          'dropped': 1}, broker.stats())
+
+    def test_unsubscribe(self):
+        broker = Broker()
+        subscription = broker.subscribe(1)
+        broker.unsubscribe(subscription)
+        self.assertFalse(broker.has_subscribers(1))
+
+
+class TestPartitions(unittest.TestCase):
+
+    def test_parse_partitions(self):
+        self.assertEqual({1: 'sqlite:///football.sqlite3', 2: 'sqlite:///golf.sqlite3', 3: 'sqlite:///golf.sqlite3'},
+                         parse_partitions('1=sqlite:///football.sqlite3; 2,3=sqlite:///golf.sqlite3'))
+        self.assertEqual({}, parse_partitions(''))
+        with self.assertRaises(ValueError):
+            parse_partitions('1,2')
+
+    def test_sessions_follow_the_partition(self):
+        engines = {DEFAULT: create_engine('sqlite://'), 'golf': create_engine('sqlite://')}
+        partitions = Partitions(engines, {2: 'golf'}, sessionmaker())
+        self.assertEqual(DEFAULT, partitions.for_sport(1))
+        self.assertEqual('golf', partitions.for_sport(2))
+        with partitions.use('golf'):
+            self.assertIs(engines['golf'], partitions.session.get_bind())
+        self.assertIs(engines[DEFAULT], partitions.session.get_bind())
+        self.assertEqual([(DEFAULT, engines[DEFAULT]), ('golf', engines['golf'])],
+                         partitions.map(lambda: partitions.session.get_bind()))
+        partitions.session.remove()
+
+    def test_sessions_keep_the_factory_class(self):
+        # benchmarks configure the scoped session, and the app's listeners are registered on the factory's class
+        factory = sessionmaker()
+        partitions = Partitions({DEFAULT: create_engine('sqlite://')}, {}, factory)
+        partitions.session.configure(autoflush=False)
+        self.assertIsInstance(partitions.session(), factory.class_)
+        self.assertFalse(partitions.session().autoflush)
+        partitions.session.remove()
+
+    def test_merge_matches(self):
+        first = [(1, 'b', 'B', datetime(2021, 1, 3)), (3, 'a', None, datetime(2021, 1, 1))]
+        second = [(2, 'c', 'A', datetime(2021, 1, 2))]
+        self.assertEqual([1, 2, 3], [row[0] for row in merge_matches([first, second], 'id')])
+        self.assertEqual([3, 2, 1], [row[0] for row in merge_matches([first, second], 'name')])
+        self.assertEqual([1, 2, 3], [row[0] for row in merge_matches([first, second], 'startTime')])
+        self.assertEqual([1, 3, 2], [row[0] for row in merge_matches([first, second])])
+
+
+class TestWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, 'writer.sock')
+        self.applied = []
+        self.server = WriterServer(self.address, self.apply)
+        self.server.bind()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.close()
+        os.rmdir(self.directory)
+
+    def apply(self, messages):
+        self.applied.extend(messages)
+        return ['OK'] * len(messages), [message['id'] for message in messages]
+
+    def test_forward_messages(self):
+        client = WriterClient(self.address, timeout=5)
+        self.assertEqual((['OK', 'OK'], [1, 2]), client.send([{'id': 1}, {'id': 2}]))
+        self.assertEqual((['OK'], [3]), client.send([{'id': 3}]))
+        self.assertEqual([{'id': 1}, {'id': 2}, {'id': 3}], self.applied)
+        client.close()
+
+    def test_tcp_writer_needs_an_authkey(self):
+        with self.assertRaises(ValueError):
+            WriterServer('127.0.0.1:0', self.apply).bind()
+
+    def test_writer_unavailable(self):
+        self.server.close()
+        with self.assertRaises(WriterUnavailable):
+            WriterClient(self.address, timeout=5).send([{'id': 1}])
+
+
+class TestIngestQueue(unittest.TestCase):
+
+    def test_batches_keep_order_and_flush_on_stop(self):
+        batches = []
+        ingest_queue = IngestQueue(batches.append, maxsize=100, batch_size=10, linger=0.01)
+        for i in range(25):
+            self.assertTrue(ingest_queue.put(i))
+        ingest_queue.start()
+        ingest_queue.stop()
+
+        self.assertEqual(list(range(25)), [message for batch in batches for message in batch])
+        self.assertTrue(all(len(batch) <= 10 for batch in batches))
+        stats = ingest_queue.stats()
+        self.assertEqual((0, 25, 25), (stats['depth'], stats['accepted'], stats['processed']))
+        self.assertEqual(len(batches), stats['batches'])
+
+    def test_rejects_when_full(self):
+        ingest_queue = IngestQueue(lambda batch: None, maxsize=2)
+        self.assertTrue(ingest_queue.put(1))
+        self.assertTrue(ingest_queue.put(2))
+        self.assertFalse(ingest_queue.put(3))
+        self.assertEqual(1, ingest_queue.stats()['rejected'])
+
+    def test_failed_batch_does_not_stop_the_writer(self):
+        batches = []
+
+        def apply_batch(batch):
+            batches.append(batch)
+            if batch == [1]:
+                raise ValueError('broken batch')
+
+        ingest_queue = IngestQueue(apply_batch, batch_size=1, linger=0)
+        ingest_queue.start()
+        ingest_queue.put(1)
+        ingest_queue.put(2)
+        ingest_queue.stop()
+
+        self.assertEqual([[1], [2]], batches)
+        self.assertEqual(1, ingest_queue.stats()['failed_batches'])
+
+
+class TestOddsLogSummary(unittest.TestCase):
+
+    def test_summarizes_updates_per_interval(self):
+        logger = logging.getLogger('test.odds')
+        with self.assertLogs(logger, level='DEBUG') as logs:
+            summary = OddsLogSummary(logger, interval=60)
+            summary.record(1, 3, 0)
+            summary.record(2, 2, 1)
+            summary.interval = 0
+            summary.record(1, 3, 0)
+
+        self.assertEqual(['INFO:test.odds:3 odds updates on 2 markets in the last %.1fs: 8 selections updated, '
+                          '1 not found.' % (float(logs.records[0].args[2]))], logs.output)
+
+    def test_samples_market_lines(self):
+        logger = logging.getLogger('test.odds.sampled')
+        with self.assertLogs(logger, level='DEBUG') as logs:
+            summary = OddsLogSummary(logger, interval=60, sample_rate=1.0)
+            summary.record(1, 3, 0)
+
+        self.assertEqual(['DEBUG:test.odds.sampled:Odds of market with Id: 1 are updated for 3 selections, '
+                          '0 selections not found.'], logs.output)
+
+
+class TestRequestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.metrics = RequestMetrics()
+        self.metrics.instrument(self.engine)
+
+    def test_counts_statements_per_request(self):
+        self.metrics.start()
+        with self.engine.connect() as connection:
+            connection.execute(text('select 1'))
+            connection.execute(text('select 2'))
+        self.metrics.finish('GET', '/api/match/<int:id>')
+
+        output = self.metrics.render()
+        labels = 'method="GET",route="/api/match/<int:id>"'
+        self.assertIn('http_request_db_statements_bucket{%s,le="1.0"} 0' % labels, output)
+        self.assertIn('http_request_db_statements_bucket{%s,le="2.0"} 1' % labels, output)
+        self.assertIn('http_request_db_statements_sum{%s} 2.0' % labels, output)
+        self.assertIn('http_request_duration_seconds_count{%s} 1' % labels, output)
+
+    def test_ignores_statements_outside_requests(self):
+        with self.engine.connect() as connection:
+            connection.execute(text('select 1'))
+
+        self.assertNotIn('_count', self.metrics.render())
+
+    def test_slow_request_log(self):
+        logger = logging.getLogger('test.slow_requests')
+        metrics = RequestMetrics(slow_request_ms=0.000001, slow_log=logger)
+        metrics.instrument(self.engine)
+        with self.assertLogs(logger) as logs:
+            metrics.start()
+            with self.engine.connect() as connection:
+                connection.execute(text('select   1'))
+            metrics.finish('GET', '/api/match/')
+
+        self.assertIn('GET /api/match/ took', logs.output[0])
+        self.assertIn('1 statements', logs.output[0])
+        self.assertTrue(logs.output[0].endswith(' ms  select 1'))
+
+
+class TestEncoders(unittest.TestCase):
+    rows = [(1, 'http://example.com/api/match/1', 'A vs B vs C', datetime(2021, 1, 1, 0, 0, 0), 1, 'golf',
+             1, 'Winner', 1, 'A', 1.01),
+            (1, 'http://example.com/api/match/1', 'A vs B vs C', datetime(2021, 1, 1, 0, 0, 0), 1, 'golf',
+             1, 'Winner', 8243901714083343527, 'B', 10.2)]
+
+    def test_format_datetime(self):
+        value = datetime(2021, 1, 2, 3, 4, 5, 678)
+        self.assertEqual(value.strftime('%Y-%m-%d %H:%M:%S'), encoders.format_datetime(value))
+
+    def test_stdlib_encode_match_is_byte_compatible(self):
+        expected = json.dumps({'id': 1, 'url': 'http://example.com/api/match/1', 'name': 'A vs B vs C',
+                               'startTime': '2021-01-01 00:00:00', 'sport': {'id': 1, 'name': 'golf'},
+                               'markets': [{'id': 1, 'name': 'Winner',
+                                            'selections': [dict(id=1, name='A', odds=1.01),
+                                                           dict(id=8243901714083343527, name='B', odds=10.2)]}]})
+        dumps = encoders.dumps
+        try:
+            encoders.dumps = encoders.stdlib_dumps
+            self.assertEqual(expected, encoders.encode_match(self.rows))
+        finally:
+            encoders.dumps = dumps
+
+    def test_encode_matches(self):
+        expected = [{'id': 1, 'url': 'http://example.com/api/match/1', 'name': 'A vs B vs C',
+                     'startTime': '2021-01-01 00:00:00'}] * 2
+        self.assertEqual(expected, json.loads(encoders.encode_matches(self.rows)))
+        self.assertEqual(expected, [json.loads(line) for line in encoders.encode_matches_ndjson(self.rows).splitlines()])
+
+
+class TestValidation(unittest.TestCase):
+
+    def message(self):
+        return {"id": 1, "message_type": "UpdateOdds",
+                "event": {"id": 1, "name": "A vs B vs C", "startTime": "2021-01-01 00:00:00",
+                          "sport": {"id": 1, "name": "Golf"},
+                          "markets": [{"id": 1, "name": "Winner",
+                                       "selections": [{"id": 1, "name": "A", "odds": 1.01},
+                                                      {"id": 2, "name": "B", "odds": 1.01}]},
+                                      {"id": 2, "name": "Place", "selections": []}]}}
+
+    def test_valid_message(self):
+        self.assertIsNone(message_error(self.message()))
+
+    def test_error_paths(self):
+        message = self.message()
+        message['event']['markets'][0]['selections'][1]['odds'] = 'not available'
+        self.assertEqual('event.markets[0].selections[1].odds', message_error(message))
+
+        message = self.message()
+        del message['event']['sport']
+        self.assertEqual('event.sport', message_error(message))
+
+        message = self.message()
+        message['event']['markets'][1]['id'] = True
+        self.assertEqual('event.markets[1].id', message_error(message))
+
+        message = self.message()
+        message['event']['markets'] = []
+        self.assertEqual('event.markets', message_error(message))
+
+    def test_not_an_object(self):
+        self.assertEqual('message', message_error(None))
+        self.assertEqual('message', message_error([]))
+        self.assertEqual('id', message_error({}))
+
+
+class TestQueryPlans(unittest.TestCase):
+    engine = create_engine('sqlite:///db.sqlite3')
+    Session = sessionmaker(bind=engine)
 
+    @classmethod
+    def setUpClass(cls):
+        create_indexes(cls.engine)
+        cls.session = cls.Session()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.close()
+
+    def query_plan(self, sql):
+        plan = [row[3] for row in self.session.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+        for step in plan:
+            if step.startswith(('SCAN', 'SEARCH')):
+                self.assertIn(' USING ', step, 'Full table scan in %s' % plan)
+        return ' | '.join(plan)
+
+    def listing_sql(self, **kwargs):
+        statement, params = matches_query(**kwargs)
+        return str(statement.params(params).compile(self.engine, compile_kwargs={'literal_binds': True}))
+
+    def test_get_match_plan(self):
+        statement = match_statement.params(event_id=1)
+        sql = str(statement.compile(self.engine, compile_kwargs={'literal_binds': True}))
+        plan = self.query_plan(sql)
+        self.assertIn('ix_odd_market_id_selection_id', plan)
+
+    def test_get_matches_by_sport_plan(self):
+        plan = self.query_plan(self.listing_sql(sport='Golf'))
+        self.assertIn('ix_sport_lower_name', plan)
+        self.assertIn('ix_market_sport_id', plan)
+        self.assertIn('ix_event_market_id', plan)
+
+    def test_get_matches_by_name_plan(self):
+        plan = self.query_plan(self.listing_sql(name='A vs B vs C'))
+        self.assertIn('ix_event_name', plan)
+
+    def test_get_matches_ordering_plan(self):
+        plan = self.query_plan(self.listing_sql(ordering='startTime'))
+        self.assertIn('ix_event_start_time', plan)
+
+    def test_get_matches_page_plan(self):
+        statement, params = matches_query(limit=10, cursor='WyIyMDIxLTAxLTAxIDAwOjAwOjAwLjAwMDAwMCIsIDFd')
+        sql = str(statement.params(params).compile(self.engine, compile_kwargs={'literal_binds': True}))
+        plan = self.query_plan(sql)
+        self.assertIn('ix_event_start_time', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_get_match_markets_plan(self):
+        statement = match_statement.params(event_id=1)
+        sql = str(statement.compile(self.engine, compile_kwargs={'literal_binds': True}))
+        self.assertRegex(self.query_plan(sql), r'event_market USING (COVERING INDEX|PRIMARY KEY)')
+
+    def test_update_odds_events_plan(self):
+        statement = self.session.query(event_market.c.EventId).filter(event_market.c.MarketId.in_((1, 2))).statement
+        sql = str(statement.compile(self.engine, compile_kwargs={'literal_binds': True}))
+        self.assertIn('ix_event_market_market_id', self.query_plan(sql))
+
+    def test_odds_history_plan(self):
+        statement = odds_history_statement.params(market_id=1, selection_id=1, start=datetime(2021, 1, 1),
+                                                  end=datetime(2021, 1, 2), limit=-1)
+        sql = str(statement.compile(self.engine, compile_kwargs={'literal_binds': True}))
+        plan = self.query_plan(sql)
+        self.assertIn('ix_odd_history_market_id_selection_id_timestamp', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_update_odds_plan(self):
+        statement = self.session.query(Odd.selection_id).filter(Odd.market_id == 1).statement
+        sql = str(statement.compile(self.engine, compile_kwargs={'literal_binds': True}))
+        plan = self.query_plan(sql)
+        self.assertIn('ix_odd_market_id_selection_id', plan)
 
 if __name__ == '__main__':
     unittest.main()
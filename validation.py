@@ -0,0 +1,77 @@
+class ListOf(object):
+
+    def __init__(self, item, min_items=0):
+        self.item = item
+        self.min_items = min_items
+
+
+SELECTION = {'id': int, 'name': str, 'odds': float}
+
+MARKET = {'id': int, 'name': str, 'selections': ListOf(SELECTION)}
+
+EVENT = {'id': int, 'name': str, 'startTime': str,
+         'sport': {'id': int, 'name': str},
+         'markets': ListOf(MARKET, min_items=1)}
+
+# NewEvent and UpdateOdds messages share one shape
+MESSAGE = {'id': int, 'message_type': str, 'event': EVENT}
+
+
+def compile_schema(schema):
+    # generates one flat function with a type check per field, so validating a message costs no extra calls;
+    # it returns None for a valid value, or the path to the first invalid value as a tuple
+    lines = []
+    names = {'type', 'len', 'enumerate', 'dict', 'list'}
+    variables = []
+
+    def emit(schema, variable, path, indent):
+        pad = ' ' * indent
+        failure = '%sreturn (%s)' % (pad + ' ' * 4, ''.join('%s, ' % part for part in path))
+
+        if isinstance(schema, dict):
+            lines.append('%sif type(%s) is not dict:' % (pad, variable))
+            lines.append(failure)
+            for key, field in schema.items():
+                variables.append(variable)
+                child = 'value%d' % len(variables)
+                lines.append('%s%s = %s.get(%r)' % (pad, child, variable, key))
+                emit(field, child, path + [repr(key)], indent)
+        elif isinstance(schema, ListOf):
+            if schema.min_items:
+                lines.append('%sif type(%s) is not list or len(%s) < %d:' % (pad, variable, variable, schema.min_items))
+            else:
+                lines.append('%sif type(%s) is not list:' % (pad, variable))
+            lines.append(failure)
+            variables.append(variable)
+            index = 'index%d' % len(variables)
+            item = 'value%d' % len(variables)
+            lines.append('%sfor %s, %s in enumerate(%s):' % (pad, index, item, variable))
+            emit(schema.item, item, path + [index], indent + 4)
+        else:
+            # exact type match, so True is not an int and 10 is not a float
+            names.add(schema.__name__)
+            lines.append('%sif type(%s) is not %s:' % (pad, variable, schema.__name__))
+            lines.append(failure)
+
+    emit(schema, 'value0', [], 4)
+    # builtins and types are bound as defaults so every lookup in the loops is a fast local
+    lines.insert(0, 'def validate(value0, %s):' % ', '.join('%s=%s' % (name, name) for name in sorted(names)))
+    lines.append('    return None')
+    namespace = {}
+    exec(compile('\n'.join(lines), '<schema>', 'exec'), namespace)
+    return namespace['validate']
+
+
+def format_path(path):
+    text = ''
+    for part in path:
+        text += '[%d]' % part if isinstance(part, int) else ('.' if text else '') + part
+    return text or 'message'
+
+
+validate_message = compile_schema(MESSAGE)
+
+
+def message_error(message):
+    error = validate_message(message)
+    return None if error is None else format_path(error)
@@ -0,0 +1,113 @@
+from multiprocessing.connection import Client, Listener
+import logging
+import os
+import threading
+
+log = logging.getLogger('ingest.writer')
+
+
+def parse_address(address):
+    # host:port is a TCP address, anything else the path of a unix socket
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+class WriterUnavailable(Exception):
+    pass
+
+
+class WriterClient(object):
+
+    def __init__(self, address, authkey=None, timeout=30):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.timeout = timeout
+        # one connection per request thread, a connection carries one request at a time
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = Client(self.address, authkey=self.authkey)
+        return connection
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        self.local.connection = None
+        if connection is not None:
+            connection.close()
+
+    def send(self, messages):
+        # a connection broken since its last use (writer restarted) is reopened once, anything after that is an error
+        for attempt in (1, 2):
+            try:
+                connection = self.connection()
+                connection.send(messages)
+                if not connection.poll(self.timeout):
+                    self.close()
+                    raise WriterUnavailable('No answer from the writer in %s seconds' % self.timeout)
+                results = connection.recv()
+                if results is None:
+                    raise WriterUnavailable('The writer failed to apply the messages')
+                return results
+            except (EOFError, OSError) as e:
+                self.close()
+                if attempt == 2:
+                    raise WriterUnavailable('Cannot reach the writer: %s' % e)
+
+
+class WriterServer(object):
+
+    def __init__(self, address, apply_messages, authkey=None):
+        self.address = parse_address(address)
+        self.apply_messages = apply_messages
+        self.authkey = authkey
+        # SQLite takes one writer at a time, so do the connections
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def bind(self):
+        # connections unpickle what they receive, on TCP anybody reaching the port could run code in the writer
+        if not isinstance(self.address, str) and not self.authkey:
+            raise ValueError('A TCP writer address needs WRITER_AUTHKEY')
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        self.listener = Listener(self.address, authkey=self.authkey)
+        return self.listener.address
+
+    def serve_forever(self):
+        if self.listener is None:
+            self.bind()
+        while True:
+            try:
+                connection = self.listener.accept()
+            except OSError:
+                # the listener was closed
+                return
+            except Exception as e:
+                log.warning('Rejected a writer connection: %s' % e)
+                continue
+            threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+    def handle(self, connection):
+        with connection:
+            while True:
+                try:
+                    messages = connection.recv()
+                except (EOFError, OSError):
+                    return
+                with self.lock:
+                    try:
+                        results = self.apply_messages(messages)
+                    except Exception as e:
+                        log.warning('Failed to apply %d forwarded messages: %s' % (len(messages), e))
+                        results = None
+                connection.send(results)
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.close()
+            if isinstance(self.address, str) and os.path.exists(self.address):
+                os.unlink(self.address)